@@ -0,0 +1,304 @@
+"""
+Run a script of get/set/delete operations against one vault with as few op calls as possible
+
+The script is planned against a single listing of the vault:
+operations that are answered by earlier operations in the script never reach op,
+and only the final state of each written key is stored.
+Independent reads and writes run concurrently.
+"""
+
+import json
+import shlex
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.op import (
+    list_all_secure_note_names_and_ids,
+    find_note_id,
+    find_pack_for_key,
+    read_pack,
+    update_pack,
+    get_secure_note_content_by_id,
+    create_new_secure_note_with_name_and_content,
+    update_secure_note_by_id,
+    delete_secure_note_by_id,
+    remove_duplicate_notes,
+)
+from lib.parallel import DEFAULT_CONCURRENCY
+from lib.snapshot import forget_snapshot_keys
+from lib.lock import advisory_lock
+from lib.completion import record_key
+
+OPERATIONS = ["get", "set", "delete"]
+
+
+class BatchScriptError(Exception):
+    pass
+
+
+def _create_note(vault_id, key, value):
+    """
+    Creates a note for a key missing from the script's listing.
+    Takes the same lock as set-item, so it does not interleave with set-item writers
+    on this host; duplicates with any of them are removed after all writes finish.
+    """
+    with advisory_lock(vault_id, key):
+        create_new_secure_note_with_name_and_content(vault_id, key, value)
+    record_key(vault_id, key, True)
+
+
+def check_operation_name(op):
+    if op not in OPERATIONS:
+        raise BatchScriptError(
+            f"Unknown operation '{op}', expected one of {', '.join(OPERATIONS)}"
+        )
+
+
+def parse_operation(line):
+    """
+    Parses one line of a batch script, either a JSON object such as
+    `{"op": "set", "key": "a.b", "value": "c"}` or the equivalent `set a.b c`.
+    Returns None for blank lines and `#` comments.
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    if line.startswith("{"):
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise BatchScriptError(f"Invalid JSON: {e}") from e
+        op, key, value = data.get("op"), data.get("key"), data.get("value")
+        check_operation_name(op)
+    else:
+        try:
+            tokens = shlex.split(line)
+        except ValueError as e:
+            raise BatchScriptError(str(e)) from e
+        op = tokens[0]
+        check_operation_name(op)
+        expected = 3 if op == "set" else 2
+        if len(tokens) != expected:
+            usage = f"{op} KEY VALUE" if op == "set" else f"{op} KEY"
+            raise BatchScriptError(f"Expected `{usage}`")
+        key, value = tokens[1], tokens[2] if op == "set" else None
+    if not isinstance(key, str) or not key:
+        raise BatchScriptError("Missing key")
+    if op == "set":
+        if not isinstance(value, str):
+            raise BatchScriptError("Missing value")
+        return {"op": op, "key": key, "value": value}
+    return {"op": op, "key": key}
+
+
+def parse_script(lines):
+    operations = []
+    for line_number, line in enumerate(lines, start=1):
+        try:
+            operation = parse_operation(line)
+        except BatchScriptError as e:
+            raise BatchScriptError(f"Line {line_number}: {e}") from e
+        if operation is not None:
+            operations.append(operation)
+    return operations
+
+
+def plan_operations(operations):
+    """
+    Walks the script once, tracking what each key holds so far (None once deleted).
+
+    Returns (steps, reads, writes) where `steps` says for each operation how its
+    result is obtained, `reads` holds the keys whose stored value is needed,
+    and `writes` maps each written key to its final value (None to delete it).
+    """
+    state = {}
+    steps = []
+    reads = set()
+    writes = {}
+    for operation in operations:
+        key = operation["key"]
+        known = key in state
+        if operation["op"] == "get":
+            if known:
+                steps.append(("value", state[key]))
+            else:
+                reads.add(key)
+                steps.append(("stored_value", None))
+        elif operation["op"] == "set":
+            steps.append(
+                ("created", state[key] is None) if known else ("stored_missing", None)
+            )
+            state[key] = operation["value"]
+            writes[key] = operation["value"]
+        else:
+            steps.append(
+                ("deleted", state[key] is not None)
+                if known
+                else ("stored_exists", None)
+            )
+            state[key] = None
+            writes[key] = None
+    return steps, reads, writes
+
+
+def estimate_unbatched_calls(operation, exists, packed):
+    """
+    Number of op calls the equivalent standalone opkvs invocation makes,
+    counting the vault lookup and the listing every invocation starts with
+    """
+    pack_read = 1 if packed else 0
+    if operation == "get":
+        return 2 + (1 if exists or packed else 0)
+    if operation == "set":
+        # creating a note is followed by a listing to check for duplicates
+        return 3 + (pack_read if packed else 0 if exists else 1)
+    if not exists:
+        return 2 + pack_read
+    # existence check, then delete_item lists again before writing
+    return 4 + (3 if packed else 0)
+
+
+def execute_operations(
+    vault_id,
+    operations,
+    max_workers=DEFAULT_CONCURRENCY,
+    names_and_ids=None,
+    stats=None,
+):
+    """
+    Yields one result per operation, in input order.
+
+    `names_and_ids` may be passed in by callers that already listed the vault.
+    If `stats` is given, `stats["unbatched_calls"]` is set to the number of op calls
+    the operations would have cost as separate opkvs invocations.
+    """
+    steps, reads, writes = plan_operations(operations)
+    if names_and_ids is None:
+        names_and_ids = list_all_secure_note_names_and_ids(vault_id)
+
+    packs_by_key = {
+        key: find_pack_for_key(names_and_ids, key) for key in reads | set(writes)
+    }
+    pack_ids = {pack_id for _, pack_id in packs_by_key.values() if pack_id is not None}
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        pack_futures = {
+            pack_id: executor.submit(read_pack, vault_id, pack_id)
+            for pack_id in pack_ids
+        }
+        packs = {
+            pack_id: future.result()[1] for pack_id, future in pack_futures.items()
+        }
+
+        def packed_items(key):
+            _, pack_id = packs_by_key[key]
+            return packs[pack_id] if pack_id is not None else {}
+
+        def stored_exists(key):
+            return (
+                key in packed_items(key) or find_note_id(names_and_ids, key) is not None
+            )
+
+        def read_value(key):
+            items = packed_items(key)
+            if key in items:
+                return items[key]
+            note_id = find_note_id(names_and_ids, key)
+            if note_id is None:
+                return None
+            return get_secure_note_content_by_id(vault_id, note_id)
+
+        # Reads observe the vault as it was before the script, so they finish
+        # before any write is started
+        read_futures = {key: executor.submit(read_value, key) for key in reads}
+        for future in read_futures.values():
+            future.result()
+
+        write_futures = {}
+        # Deletes of notes left over from before a namespace was packed
+        cleanup_futures = {}
+        packed_writes = {}
+        forget_snapshot_keys(vault_id, writes)
+        for key, value in writes.items():
+            prefix, pack_id = packs_by_key[key]
+            note_id = find_note_id(names_and_ids, key)
+            if pack_id is not None:
+                packed_writes.setdefault((prefix, pack_id), {})[key] = value
+                # Keys of a packed namespace live in the pack only
+                if note_id is not None:
+                    cleanup_futures[key] = executor.submit(
+                        delete_secure_note_by_id, vault_id, note_id
+                    )
+            elif value is not None and note_id is not None:
+                write_futures[key] = executor.submit(
+                    update_secure_note_by_id, vault_id, note_id, value
+                )
+            elif value is not None:
+                write_futures[key] = executor.submit(_create_note, vault_id, key, value)
+            elif note_id is not None:
+                write_futures[key] = executor.submit(
+                    delete_secure_note_by_id, vault_id, note_id
+                )
+
+        for (prefix, pack_id), changes in packed_writes.items():
+
+            def mutate(items, changes=changes):
+                for key, value in changes.items():
+                    if value is None:
+                        items.pop(key, None)
+                    else:
+                        items[key] = value
+                return items
+
+            future = executor.submit(update_pack, vault_id, pack_id, prefix, mutate)
+            for key in changes:
+                write_futures[key] = future
+
+        # Writers on other hosts may have created some of the same keys,
+        # one listing finds and resolves all such duplicates
+        created = [
+            key
+            for key, value in writes.items()
+            if value is not None
+            and packs_by_key[key][1] is None
+            and find_note_id(names_and_ids, key) is None
+        ]
+        if created:
+            for key in created:
+                write_futures[key].result()
+            remove_duplicate_notes(vault_id, created)
+
+        if stats is not None:
+            exists = {key: stored_exists(key) for key in packs_by_key}
+            unbatched_calls = 0
+            for operation in operations:
+                key = operation["key"]
+                unbatched_calls += estimate_unbatched_calls(
+                    operation["op"], exists[key], packs_by_key[key][1] is not None
+                )
+                if operation["op"] != "get":
+                    exists[key] = operation["op"] == "set"
+            stats["unbatched_calls"] = unbatched_calls
+
+        for index, (operation, (kind, known)) in enumerate(zip(operations, steps)):
+            key = operation["key"]
+            result = {"index": index, "op": operation["op"], "key": key, "ok": True}
+            if key in write_futures and operation["op"] != "get":
+                write_futures[key].result()
+            if key in cleanup_futures and operation["op"] != "get":
+                cleanup_futures[key].result()
+            if kind == "value":
+                result.update({"found": known is not None, "value": known})
+            elif kind == "stored_value":
+                value = read_futures[key].result()
+                result.update({"found": value is not None, "value": value})
+            elif kind == "created":
+                result["created"] = known
+            elif kind == "stored_missing":
+                result["created"] = not stored_exists(key)
+            else:
+                existed = known if kind == "deleted" else stored_exists(key)
+                if not existed:
+                    result.update(
+                        {"ok": False, "error": f"No item with key '{key}' found"}
+                    )
+            yield result
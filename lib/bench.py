@@ -0,0 +1,148 @@
+"""
+Latency profiling of the op backend, through the same code paths commands use
+
+Each operation (list/get/set/delete) goes through lib.op, so its latency includes
+every op call it makes. Those calls are timed individually as well, split into
+spawning the process and waiting for op to finish.
+"""
+
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.op import (
+    list_items,
+    get_item,
+    set_item,
+    delete_item,
+    set_op_timing_listener,
+)
+
+OPERATION_TYPES = ["list", "get", "set", "delete"]
+BENCH_KEY_PREFIX = "opkvs-bench."
+
+
+def parse_mix(mix):
+    """Parses `list=1,get=4,set=2,delete=1` into a dict of weights"""
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATION_TYPES:
+            expected = ", ".join(OPERATION_TYPES)
+            raise ValueError(f"Unknown operation '{name}', expected one of {expected}")
+        try:
+            weights[name] = float(weight) if weight else 1.0
+        except ValueError as e:
+            raise ValueError(f"Invalid weight for '{name}': '{weight}'") from e
+    if not any(weights.values()):
+        raise ValueError("The operation mix needs at least one positive weight")
+    return weights
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize_seconds(values):
+    if not values:
+        return None
+    return {
+        "p50": round(percentile(values, 50) * 1000, 2),
+        "p95": round(percentile(values, 95) * 1000, 2),
+        "p99": round(percentile(values, 99) * 1000, 2),
+        "mean": round(sum(values) / len(values) * 1000, 2),
+    }
+
+
+def run_level(vault_id, weights, concurrency, operations, keys_per_worker, seed=0):
+    """
+    Runs `operations` randomly chosen operations spread over `concurrency` workers.
+    Every worker uses its own keys, and deletes what it created when done.
+    """
+    names = [name for name in OPERATION_TYPES if weights.get(name, 0) > 0]
+    operations_per_worker = math.ceil(operations / concurrency)
+    latencies = {name: [] for name in OPERATION_TYPES}
+    op_calls = {name: [] for name in OPERATION_TYPES}
+    lock = threading.Lock()
+    current = threading.local()
+
+    def on_op_call(args, spawn_seconds, run_seconds):
+        operation = getattr(current, "operation", None)
+        if operation is not None:
+            with lock:
+                op_calls[operation].append((spawn_seconds, run_seconds))
+
+    def worker(worker_index):
+        rng = random.Random(seed * 1000003 + worker_index)
+        keys = [
+            f"{BENCH_KEY_PREFIX}{concurrency}.{worker_index}.{n}"
+            for n in range(keys_per_worker)
+        ]
+        present = set()
+        for _ in range(operations_per_worker):
+            operation = rng.choices(names, [weights[name] for name in names])[0]
+            if operation == "delete" and not present:
+                operation = "set"
+            if operation == "delete":
+                key = rng.choice(sorted(present))
+            else:
+                key = rng.choice(keys)
+            current.operation = operation
+            started = time.perf_counter()
+            if operation == "list":
+                list_items(vault_id)
+            elif operation == "get":
+                get_item(vault_id, key)
+            elif operation == "set":
+                set_item(vault_id, key, f"{rng.getrandbits(64):016x}")
+                present.add(key)
+            else:
+                delete_item(vault_id, key)
+                present.discard(key)
+            elapsed = time.perf_counter() - started
+            current.operation = None
+            with lock:
+                latencies[operation].append(elapsed)
+        return present
+
+    set_op_timing_listener(on_op_call)
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            leftovers = list(executor.map(worker, range(concurrency)))
+        seconds = time.perf_counter() - started
+    finally:
+        set_op_timing_listener(None)
+
+    for present in leftovers:
+        for key in present:
+            delete_item(vault_id, key)
+
+    total = sum(len(values) for values in latencies.values())
+    return {
+        "concurrency": concurrency,
+        "operations": total,
+        "seconds": round(seconds, 3),
+        "throughput": round(total / seconds, 2) if seconds else None,
+        "by_operation": {
+            name: {
+                "count": len(latencies[name]),
+                "latency_ms": summarize_seconds(latencies[name]),
+                "op_calls_per_operation": (
+                    round(len(op_calls[name]) / len(latencies[name]), 2)
+                    if latencies[name]
+                    else None
+                ),
+                "spawn_ms": summarize_seconds([spawn for spawn, _ in op_calls[name]]),
+                "op_run_ms": summarize_seconds([run for _, run in op_calls[name]]),
+            }
+            for name in OPERATION_TYPES
+            if latencies[name]
+        },
+    }
@@ -0,0 +1,191 @@
+"""
+A small on-disk index of vault names and keys, so shell completion never waits on op
+
+The index is kept up to date as a side effect of the listings normal commands make.
+Completing from an entry older than INDEX_TTL_SECONDS starts a refresh in the background
+and serves the stale entry anyway, so completion stays fast.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+
+from lib.config import read_config_value
+from lib.fs import file_put_text_contents_atomic, get_cache_dir
+
+INDEX_TTL_SECONDS = 300
+# Don't start another background refresh while one is likely still running
+REFRESH_BACKOFF_SECONDS = 30
+
+_index_lock = threading.Lock()
+
+
+def get_index_path():
+    return os.path.join(get_cache_dir(), "completion-index.json")
+
+
+def load_index():
+    try:
+        with open(get_index_path(), "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+    index.setdefault("vaults", {"updated_at": 0, "names": {}})
+    index.setdefault("listings", {})
+    return index
+
+
+def _update_index(update):
+    with _index_lock:
+        index = load_index()
+        update(index)
+        try:
+            file_put_text_contents_atomic(get_index_path(), json.dumps(index))
+        except OSError:
+            # Completion is a convenience, never fail a command over it
+            pass
+
+
+def _get_listing(index, vault_id):
+    return index["listings"].setdefault(
+        vault_id, {"updated_at": 0, "keys": [], "pack_ids": [], "packs": {}}
+    )
+
+
+def record_vault_list(vault_list):
+    def update(index):
+        index["vaults"] = {
+            "updated_at": time.time(),
+            "names": {vault["name"]: vault["id"] for vault in vault_list},
+        }
+
+    _update_index(update)
+
+
+def record_listing(vault_id, keys, pack_ids):
+    """Records the loose keys of a vault and the ids of its packs"""
+
+    def update(index):
+        listing = _get_listing(index, vault_id)
+        listing["updated_at"] = time.time()
+        listing["keys"] = sorted(keys)
+        listing["pack_ids"] = list(pack_ids)
+        listing["packs"] = {
+            pack_id: pack_keys
+            for pack_id, pack_keys in listing["packs"].items()
+            if pack_id in pack_ids
+        }
+
+    _update_index(update)
+
+
+def record_pack(vault_id, pack_id, keys):
+    def update(index):
+        listing = _get_listing(index, vault_id)
+        listing["packs"][pack_id] = sorted(keys)
+        if pack_id not in listing["pack_ids"]:
+            listing["pack_ids"].append(pack_id)
+
+    _update_index(update)
+
+
+def record_key(vault_id, key, exists):
+    def update(index):
+        listing = _get_listing(index, vault_id)
+        keys = set(listing["keys"])
+        if exists:
+            keys.add(key)
+        else:
+            keys.discard(key)
+        listing["keys"] = sorted(keys)
+
+    _update_index(update)
+
+
+def schedule_refresh(vault_name=None):
+    """Refreshes the index in a detached `opkvs completion refresh` process"""
+    marker = os.path.join(get_cache_dir(), "completion-refresh")
+    try:
+        if time.time() - os.path.getmtime(marker) < REFRESH_BACKOFF_SECONDS:
+            return
+    except OSError:
+        pass
+    with open(marker, "w", encoding="utf-8"):
+        pass
+
+    script = os.path.join(os.path.dirname(os.path.dirname(__file__)), "opkvs.py")
+    args = [sys.executable, script, "completion", "refresh"]
+    if vault_name:
+        args += ["--vault", vault_name]
+    env = {
+        name: value for name, value in os.environ.items() if name != "_OPKVS_COMPLETE"
+    }
+    options = {}
+    if os.name == "nt":
+        options["creationflags"] = subprocess.DETACHED_PROCESS
+    else:
+        options["start_new_session"] = True
+    subprocess.Popen(
+        args,
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        **options,
+    )
+
+
+def is_stale(entry):
+    return time.time() - entry.get("updated_at", 0) > INDEX_TTL_SECONDS
+
+
+def get_cached_vault_names():
+    index = load_index()
+    if is_stale(index["vaults"]):
+        schedule_refresh()
+    return sorted(index["vaults"]["names"])
+
+
+def get_cached_keys(vault_name):
+    index = load_index()
+    vault_id = index["vaults"]["names"].get(vault_name, None)
+    listing = index["listings"].get(vault_id, None) if vault_id else None
+    if listing is None or is_stale(listing):
+        schedule_refresh(vault_name)
+    if listing is None:
+        return []
+    keys = list(listing["keys"])
+    for pack_id in listing["pack_ids"]:
+        keys.extend(listing["packs"].get(pack_id, []))
+    return keys
+
+
+def get_cached_pack_keys(vault_id):
+    """Keys of the vault's packs as last read, by pack id (unread packs are missing)"""
+    listing = load_index()["listings"].get(vault_id, None)
+    return dict(listing["packs"]) if listing is not None else {}
+
+
+def find_vault_name(ctx):
+    """The vault the command line being completed refers to, inferred like commands do"""
+    while ctx is not None:
+        if ctx.params.get("vault"):
+            vault = ctx.params["vault"]
+            # Commands listing several vaults accept the option more than once
+            return vault[0] if isinstance(vault, (list, tuple)) else vault
+        ctx = ctx.parent
+    return read_config_value("vault_name", None)
+
+
+def complete_vault_name(ctx, param, incomplete):
+    return [name for name in get_cached_vault_names() if name.startswith(incomplete)]
+
+
+def complete_key(ctx, param, incomplete):
+    vault_name = find_vault_name(ctx)
+    if not vault_name:
+        return []
+    return [key for key in get_cached_keys(vault_name) if key.startswith(incomplete)]
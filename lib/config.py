@@ -21,6 +21,7 @@ class Config:
             self.data = json.load(f)
 
     def set(self, key, value):
+        self.load()
         self.data[key] = value
         self.save()
         return self
@@ -28,3 +29,16 @@ class Config:
     def get(self, key, default=None):
         self.load()
         return self.data.get(key, default)
+
+
+def read_config_value(key, default=None):
+    """
+    Reads a value from opkvs.json in the current working directory
+    without creating the file, for callers that must stay side-effect free
+    """
+    path = os.path.join(os.getcwd(), "opkvs.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get(key, default)
+    except (OSError, ValueError):
+        return default
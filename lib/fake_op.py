@@ -0,0 +1,175 @@
+"""
+A stand-in for the 1Password CLI, implementing the subset of `op` opkvs uses
+
+Items are kept in a JSON file (OPKVS_FAKE_OP_STATE), so separate processes see the same
+vaults. OPKVS_FAKE_OP_LATENCY_MS adds an artificial delay to every call to mimic
+network round trips. If OPKVS_FAKE_OP_SESSION is set, every call must have it in
+OP_SESSION_fake (`signin` prints the export), to mimic a signed-out op.
+Used by `opkvs bench --backend fake`.
+
+    python lib/fake_op.py item list --vault bench --format=json
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.fs import file_put_text_contents_atomic  # noqa: E402
+from lib.lock import advisory_lock  # noqa: E402
+
+SUMMARY_FIELDS = ["id", "title", "version", "category", "created_at", "updated_at"]
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def load_state(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"vaults": [{"id": "fake-bench", "name": "bench"}], "items": []}
+
+
+def pop_option(args, name):
+    for i, arg in enumerate(args):
+        if arg == name:
+            value = args[i + 1]
+            del args[i : i + 2]
+            return value
+        if arg.startswith(name + "="):
+            del args[i]
+            return arg.split("=", 1)[1]
+    return None
+
+
+def pop_flag(args, name):
+    if name in args:
+        args.remove(name)
+        return True
+    return False
+
+
+def fail(message):
+    sys.stderr.write(f"[ERROR] {message}\n")
+    sys.exit(1)
+
+
+def summarize(item):
+    summary = {field: item[field] for field in SUMMARY_FIELDS}
+    summary["vault"] = {"id": item["vault"]}
+    return summary
+
+
+def describe(item):
+    described = summarize(item)
+    described["fields"] = [
+        {"id": label, "label": label, "type": "STRING", "value": value}
+        for label, value in item["fields"].items()
+    ]
+    return described
+
+
+def find_vault_id(state, name_or_id):
+    for vault in state["vaults"]:
+        if name_or_id in (vault["id"], vault["name"]):
+            return vault["id"]
+    fail(f'"{name_or_id}" isn\'t a vault in this account')
+
+
+def assign_fields(item, assignments):
+    for assignment in assignments:
+        label, value = assignment.split("=", 1)
+        item["fields"][label] = value
+
+
+def run(args, state):
+    """Returns (output, changed)"""
+    output_format = pop_option(args, "--format")
+    required_session = os.environ.get("OPKVS_FAKE_OP_SESSION", None)
+    if args[:1] == ["signin"]:
+        return f'export OP_SESSION_fake="{required_session or ""}"', False
+    if required_session and os.environ.get("OP_SESSION_fake") != required_session:
+        fail(
+            "You are not currently signed in. "
+            "Please run `op signin --help` for instructions"
+        )
+    if args[:2] == ["vault", "list"]:
+        return json.dumps(state["vaults"]), False
+    if args[:1] == ["whoami"]:
+        return json.dumps({"user_type": "FAKE"}), False
+    if args[:1] != ["item"] or len(args) < 2:
+        fail(f"unsupported command: {' '.join(args)}")
+
+    command, args = args[1], args[2:]
+    vault_name = pop_option(args, "--vault")
+    vault_id = find_vault_id(state, vault_name) if vault_name else None
+
+    if command == "list":
+        categories = pop_option(args, "--categories")
+        items = [item for item in state["items"] if item["vault"] == vault_id]
+        if categories == "SecureNote":
+            items = [item for item in items if item["category"] == "SECURE_NOTE"]
+        return json.dumps([summarize(item) for item in items]), False
+
+    if command == "create":
+        pop_option(args, "--category")
+        item = {
+            "id": uuid.uuid4().hex[:26],
+            "title": pop_option(args, "--title"),
+            "version": 1,
+            "vault": vault_id,
+            "category": "SECURE_NOTE",
+            "created_at": now(),
+            "updated_at": now(),
+            "fields": {},
+        }
+        assign_fields(item, args)
+        state["items"].append(item)
+        return json.dumps(describe(item)) if output_format == "json" else "", True
+
+    item_id = args.pop(0)
+    matches = [item for item in state["items"] if item["id"] == item_id]
+    if not matches:
+        fail(f'"{item_id}" isn\'t an item')
+    item = matches[0]
+
+    if command == "get":
+        pop_flag(args, "--reveal")
+        field = pop_option(args, "--fields")
+        if field is not None:
+            return item["fields"].get(field, ""), False
+        return json.dumps(describe(item)), False
+    if command == "edit":
+        assign_fields(item, args)
+        item["version"] += 1
+        item["updated_at"] = now()
+        return json.dumps(describe(item)) if output_format == "json" else "", True
+    if command == "delete":
+        state["items"].remove(item)
+        return "", True
+    fail(f"unsupported command: item {command}")
+
+
+def main():
+    latency_ms = float(os.environ.get("OPKVS_FAKE_OP_LATENCY_MS", "0"))
+    if latency_ms:
+        time.sleep(latency_ms / 1000)
+    path = os.environ.get("OPKVS_FAKE_OP_STATE", "fake-op-state.json")
+    with advisory_lock("fake-op", os.path.abspath(path)):
+        state = load_state(path)
+        output, changed = run(sys.argv[1:], state)
+        if changed:
+            file_put_text_contents_atomic(path, json.dumps(state))
+    if output:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,7 @@
+import os
+import tempfile
+
+
 def file_get_text_contents(filename, encoding="utf-8"):
     with open(filename, "r", encoding=encoding) as f:
         return f.read()
@@ -6,3 +10,33 @@ def file_get_text_contents(filename, encoding="utf-8"):
 def file_put_text_contents(filename, contents, encoding="utf-8"):
     with open(filename, "w", encoding=encoding) as f:
         f.write(contents)
+
+
+def file_put_text_contents_atomic(filename, contents, encoding="utf-8"):
+    """
+    Writes through a temporary file that is renamed into place,
+    so concurrent readers never see a partially written file
+    """
+    directory = os.path.dirname(filename) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w", encoding=encoding) as f:
+            f.write(contents)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def get_cache_dir(*parts):
+    """
+    Per-user directory for opkvs state that can be rebuilt from 1Password,
+    created (readable by the current user only) if it does not exist yet
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    path = os.path.join(base, "opkvs", *parts)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
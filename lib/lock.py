@@ -0,0 +1,40 @@
+import os
+import hashlib
+from contextlib import contextmanager
+
+from lib.fs import get_cache_dir
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+@contextmanager
+def advisory_lock(*names):
+    """
+    Holds an exclusive lock shared by every opkvs process on this host
+    that locks the same names, e.g. advisory_lock(vault_id, key)
+    """
+    digest = hashlib.sha1("\0".join(names).encode("utf-8")).hexdigest()
+    path = os.path.join(get_cache_dir("locks"), f"{digest}.lock")
+    with open(path, "a+", encoding="utf-8") as f:
+        if os.name == "nt":
+            f.seek(0)
+            # LK_LOCK gives up after ~10 seconds, keep waiting like flock does
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
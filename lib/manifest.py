@@ -0,0 +1,34 @@
+"""
+The per-project manifest of keys a deploy needs, declared in opkvs.json as e.g.
+
+    "manifest": ["production.api-key", "production.database.*"]
+
+Entries ending in `.*` require at least one key under that prefix.
+"""
+
+
+def is_prefix_entry(entry):
+    return entry.endswith(".*")
+
+
+def resolve_manifest(manifest, keys):
+    """
+    Returns (required keys, missing entries) for the manifest
+    against the keys present in a vault
+    """
+    present = set(keys)
+    required = []
+    missing = []
+    for entry in manifest:
+        if is_prefix_entry(entry):
+            prefix = entry[:-1]
+            matches = sorted(key for key in present if key.startswith(prefix))
+            if not matches:
+                missing.append(entry)
+            required.extend(key for key in matches if key not in required)
+        elif entry in present:
+            if entry not in required:
+                required.append(entry)
+        else:
+            missing.append(entry)
+    return required, missing
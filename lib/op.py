@@ -2,10 +2,18 @@ import subprocess
 import json
 import tempfile
 import os
+import threading
+import time
+import zlib
 from base64 import b64encode, b64decode
 
 from lib.cli import die
 from lib.config import Config
+from lib.completion import record_vault_list, record_listing, record_pack, record_key
+from lib.parallel import parallel_map, DEFAULT_CONCURRENCY
+from lib.lock import advisory_lock
+from lib.snapshot import forget_snapshot_keys, forget_vault_snapshots
+from lib.session import run_in_session
 
 
 def infer_selected_vault(explicit_vault_name=None, die_on_none=True):
@@ -51,13 +59,26 @@ class NoteNotFound(Exception):
     pass
 
 
-def get_vault_list():
-    as_list = json.loads(
-        subprocess.check_output(["op", "vault", "list", "--format=json"]).decode(
-            "utf-8"
+class PackConflict(Exception):
+    def __init__(self, prefix):
+        super().__init__(
+            f"""
+Could not update packed namespace '{prefix}': it kept changing underneath us.
+Another writer is probably updating the same namespace, try again.
+""".strip()
         )
-    )
-    return as_list
+
+
+# The vault list rarely changes, so it is fetched at most once per invocation
+_vault_list_cache = None
+
+
+def get_vault_list(refresh=False):
+    global _vault_list_cache
+    if _vault_list_cache is None or refresh:
+        _vault_list_cache = run_op_command_json(["vault", "list"]) or []
+        record_vault_list(_vault_list_cache)
+    return list(_vault_list_cache)
 
 
 def get_vault_id(name):
@@ -69,21 +90,63 @@ def get_vault_id(name):
     raise VaultNotFound(name)
 
 
-def run_op_command(args):
-    p = subprocess.Popen(
-        ["op"] + args,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        stdin=subprocess.DEVNULL,
-    )
-    stdout, stderr = p.communicate()
-    rc = p.returncode
-    stdout = stdout.decode("utf-8") if stdout is not None else ""
-    stderr = stderr.decode("utf-8") if stderr is not None else ""
+# Number of op processes spawned by this invocation, used to report savings
+_op_call_count = 0
+_op_call_count_lock = threading.Lock()
+
+# Command used in place of `op`, e.g. to run against lib/fake_op.py
+_op_command = ["op"]
+
+# Called as listener(args, spawn_seconds, run_seconds) after every op call
+_op_timing_listener = None
+
+
+def get_op_call_count():
+    return _op_call_count
+
+
+def set_op_command(command):
+    global _op_command
+    _op_command = list(command)
+
+
+def set_op_timing_listener(listener):
+    global _op_timing_listener
+    _op_timing_listener = listener
+
+
+def run_op_command(args, die_on_error=True):
+    global _op_call_count
+    with _op_call_count_lock:
+        _op_call_count += 1
+
+    def run(session_env):
+        started = time.perf_counter()
+        p = subprocess.Popen(
+            _op_command + args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            stdin=subprocess.DEVNULL,
+            env=session_env,
+        )
+        spawned = time.perf_counter()
+        stdout, stderr = p.communicate()
+        if _op_timing_listener is not None:
+            _op_timing_listener(args, spawned - started, time.perf_counter() - spawned)
+        return (
+            p.returncode,
+            stdout.decode("utf-8") if stdout is not None else "",
+            stderr.decode("utf-8") if stderr is not None else "",
+        )
+
+    # Authentication failures end the command here, even with die_on_error=False
+    rc, stdout, stderr = run_in_session(run, _op_command)
     if rc != 0:
+        if not die_on_error:
+            return None
         die(
             f"""
-Could not run op command: {" ".join(["op"]+args)}
+Could not run op command: {" ".join(_op_command + args)}
 stdout:
 {stdout}
 stderr:
@@ -93,7 +156,22 @@ stderr:
     return stdout
 
 
-def list_all_secure_note_names_and_ids(vault_id):
+def run_op_command_json(args):
+    output = run_op_command(args + ["--format=json"]).strip()
+    if not output:
+        return None
+    return json.loads(output)
+
+
+def encode_field_assignment(field_name, content):
+    return f'{field_name}="{b64encode(content.encode("utf-8")).decode("utf-8")}"'
+
+
+def decode_field_value(raw_value):
+    return b64decode(raw_value.strip().strip("\"'").encode("utf-8")).decode("utf-8")
+
+
+def list_all_secure_notes(vault_id):
     output = run_op_command(
         [
             "item",
@@ -105,15 +183,63 @@ def list_all_secure_note_names_and_ids(vault_id):
             "--format=json",
         ]
     ).strip()
-    if not output:
-        return []
-    notes = json.loads(output)
-    return [(note["title"], note["id"]) for note in notes]
+    notes = json.loads(output) if output else []
+    _record_notes(vault_id, notes)
+    return notes
+
+
+def list_all_items(vault_id):
+    """Lists items of every category, including ones opkvs did not create"""
+    output = run_op_command(["item", "list", "--vault", vault_id, "--format=json"])
+    items = json.loads(output.strip()) if output.strip() else []
+    _record_notes(vault_id, [item for item in items if is_secure_note(item)])
+    return items
+
+
+def is_secure_note(item):
+    return item.get("category", None) == "SECURE_NOTE"
+
+
+def _record_notes(vault_id, notes):
+    record_listing(
+        vault_id,
+        [note["title"] for note in notes if not is_pack_title(note["title"])],
+        [note["id"] for note in notes if is_pack_title(note["title"])],
+    )
+
+
+def newest_first(notes):
+    return sorted(
+        notes,
+        key=lambda note: (
+            note.get("updated_at", None) or "",
+            note.get("created_at", None) or "",
+            note["id"],
+        ),
+        reverse=True,
+    )
+
+
+def get_names_and_ids(notes):
+    # Newest first, so a title created twice by racing writers
+    # consistently resolves to the newest note
+    return [(note["title"], note["id"]) for note in newest_first(notes)]
+
+
+def list_all_secure_note_names_and_ids(vault_id):
+    return get_names_and_ids(list_all_secure_notes(vault_id))
+
 
+def find_duplicate_notes(notes):
+    """Maps each title held by more than one note to its notes, newest first"""
+    by_title = {}
+    for note in newest_first(notes):
+        by_title.setdefault(note["title"], []).append(note)
+    return {title: group for title, group in by_title.items() if len(group) > 1}
 
-def obtain_secure_note_id_by_name(vault_id, note_name):
-    all_notes_list = list_all_secure_note_names_and_ids(vault_id)
-    for title, note_id in all_notes_list:
+
+def find_note_id(names_and_ids, note_name):
+    for title, note_id in names_and_ids:
         if title == note_name:
             return note_id
     return None
@@ -126,7 +252,7 @@ def create_new_secure_note_with_name_and_content(vault_id, note_name, note_conte
         [
             "item",
             "create",
-            f'value="{b64encode(note_content.encode("utf-8")).decode("utf-8")}"',
+            encode_field_assignment("value", note_content),
             "--category",
             "Secure Note",
             "--title",
@@ -137,40 +263,66 @@ def create_new_secure_note_with_name_and_content(vault_id, note_name, note_conte
     )
 
 
-def update_secure_note_by_name(vault_id, note_name, note_content):
-    note_id = obtain_secure_note_id_by_name(vault_id, note_name)
-    if note_id is None:
-        raise NoteNotFound(f"Secure note with name '{note_name}' not found.")
-
+def update_secure_note_by_id(vault_id, note_id, note_content):
     run_op_command(
         [
             "item",
             "edit",
             note_id,
-            f'value="{b64encode(note_content.encode("utf-8")).decode("utf-8")}"',
+            encode_field_assignment("value", note_content),
             "--vault",
             vault_id,
         ],
     )
 
 
-def upsert_secure_note_by_name(vault_id, note_name, note_content):
-    note_id = obtain_secure_note_id_by_name(vault_id, note_name)
-    if note_id is not None:
-        update_secure_note_by_name(vault_id, note_name, note_content)
-        return False
-    else:
-        create_new_secure_note_with_name_and_content(vault_id, note_name, note_content)
-        return True
-
+def delete_secure_note_by_id(vault_id, note_id, missing_ok=False):
+    run_op_command(
+        ["item", "delete", note_id, "--vault", vault_id], die_on_error=not missing_ok
+    )
 
-def delete_secure_note_by_name(vault_id, note_name):
-    note_id = obtain_secure_note_id_by_name(vault_id, note_name)
-    if note_id is None:
-        raise NoteNotFound(f"Secure note with name '{note_name}' not found.")
 
-    # Run the delete command
-    run_op_command(["item", "delete", note_id])
+def remove_duplicate_notes(vault_id, titles):
+    """Deletes all but the newest note of each of the given titles"""
+    duplicates = find_duplicate_notes(list_all_secure_notes(vault_id))
+    for title in titles:
+        for note in duplicates.get(title, [])[1:]:
+            # Another writer resolving the same duplicate may delete it first
+            delete_secure_note_by_id(vault_id, note["id"], missing_ok=True)
+
+
+def create_unique_secure_note(vault_id, note_name, fields):
+    """
+    Creates a note with the given fields, then removes duplicates created concurrently
+    by writers on other hosts. Every writer keeps the same (newest) note.
+    Callers hold advisory_lock(vault_id, note_name) and have just listed the vault.
+    """
+    create_secure_note_with_fields(vault_id, note_name, fields)
+    remove_duplicate_notes(vault_id, [note_name])
+    record_key(vault_id, note_name, True)
+
+
+def upsert_secure_note_fields(vault_id, note_name, fields, names_and_ids=None):
+    """
+    Updates the given fields of a note, creating the note if there is none.
+    Writers of the same title on this host take turns, so only one of them creates it.
+    `names_and_ids` may be passed in by callers that already listed the vault.
+    Returns True if the note was created.
+    """
+    forget_snapshot_keys(vault_id, [note_name])
+    with advisory_lock(vault_id, note_name):
+        note_id = None
+        if names_and_ids is not None:
+            note_id = find_note_id(names_and_ids, note_name)
+        if note_id is None:
+            # Another writer may have created it since the vault was listed
+            names_and_ids = list_all_secure_note_names_and_ids(vault_id)
+            note_id = find_note_id(names_and_ids, note_name)
+        if note_id is not None:
+            update_secure_note_fields_by_id(vault_id, note_id, fields)
+            return False
+        create_unique_secure_note(vault_id, note_name, fields)
+        return True
 
 
 def get_secure_note_content_by_id(vault_id, note_id):
@@ -179,38 +331,382 @@ def get_secure_note_content_by_id(vault_id, note_id):
 
     # Command to retrieve only the notes content from the secure note
     output = run_op_command(
-        ["item", "get", note_id, "--vault", vault_id, "--fields", "value","--reveal"]
-    ).strip().strip("\"'")
+        ["item", "get", note_id, "--vault", vault_id, "--fields", "value", "--reveal"]
+    )
 
     # Process output to get the content of the notes directly
-    note_content = b64decode(output.encode("utf-8")).decode("utf-8")
-    return note_content
+    return decode_field_value(output)
+
+
+def create_secure_note_with_fields(vault_id, note_name, fields):
+    run_op_command(
+        ["item", "create"]
+        + [encode_field_assignment(name, value) for name, value in fields.items()]
+        + ["--category", "Secure Note", "--title", note_name, "--vault", vault_id]
+    )
+
+
+def update_secure_note_fields_by_id(vault_id, note_id, fields):
+    run_op_command(
+        ["item", "edit", note_id]
+        + [encode_field_assignment(name, value) for name, value in fields.items()]
+        + ["--vault", vault_id]
+    )
+
+
+def get_secure_note_json_by_id(vault_id, note_id):
+    return run_op_command_json(
+        ["item", "get", note_id, "--vault", vault_id, "--reveal"]
+    )
+
+
+def get_secure_note_fields_by_id(vault_id, note_id, field_names):
+    if note_id is None:
+        raise NoteNotFound("Secure note ID was not provided.")
+
+    note = get_secure_note_json_by_id(vault_id, note_id)
+    return {
+        name: decode_field_value(value)
+        for name, value in get_field_values(note).items()
+        if name in field_names and value
+    }
+
+
+def get_field_values(note):
+    return {
+        field["label"]: field["value"]
+        for field in note.get("fields", [])
+        if "label" in field and "value" in field
+    }
+
+
+# Packed namespaces
+#
+# A namespace such as `production` can be packed into a single secure note
+# titled `opkvs-pack:production`. Its `pack` field holds every `production.*`
+# key as zlib-compressed JSON, so reading any number of keys from the namespace
+# costs one `op item get`, cached for the rest of the invocation.
+
+PACK_TITLE_PREFIX = "opkvs-pack:"
+PACK_FIELD = "pack"
+PACK_WRITE_ATTEMPTS = 5
+
+# note id -> (item version, packed items)
+_pack_cache = {}
+
+
+def is_pack_title(title):
+    return title.startswith(PACK_TITLE_PREFIX)
+
+
+def pack_title(prefix):
+    return PACK_TITLE_PREFIX + prefix
+
+
+def get_packed_prefixes(names_and_ids):
+    packed = {}
+    for title, note_id in names_and_ids:
+        if is_pack_title(title):
+            packed.setdefault(title[len(PACK_TITLE_PREFIX) :], note_id)
+    return packed
+
+
+def find_pack_for_key(names_and_ids, key):
+    """
+    Returns (prefix, note id) of the most specific pack holding `key`,
+    or (None, None) if the key is stored as its own note.
+    """
+    packed = get_packed_prefixes(names_and_ids)
+    matches = [prefix for prefix in packed if key.startswith(prefix + ".")]
+    if not matches:
+        return None, None
+    prefix = max(matches, key=len)
+    return prefix, packed[prefix]
+
+
+def encode_pack(items):
+    raw = zlib.compress(json.dumps(items, sort_keys=True).encode("utf-8"))
+    return f'{PACK_FIELD}="{b64encode(raw).decode("utf-8")}"'
+
+
+def decode_pack(raw_value):
+    raw = b64decode(raw_value.strip().strip("\"'").encode("utf-8"))
+    return json.loads(zlib.decompress(raw).decode("utf-8"))
+
+
+def _remember_pack(vault_id, note_id, version, items):
+    _pack_cache[note_id] = (version, dict(items))
+    record_pack(vault_id, note_id, list(items))
+    return version, dict(items)
+
+
+def read_pack(vault_id, note_id, refresh=False):
+    if not refresh and note_id in _pack_cache:
+        version, items = _pack_cache[note_id]
+        return version, dict(items)
+    note = get_secure_note_json_by_id(vault_id, note_id)
+    fields = get_field_values(note)
+    items = decode_pack(fields[PACK_FIELD]) if PACK_FIELD in fields else {}
+    return _remember_pack(vault_id, note_id, note["version"], items)
+
+
+def create_pack(vault_id, prefix, items):
+    note = run_op_command_json(
+        [
+            "item",
+            "create",
+            encode_pack(items),
+            "--category",
+            "Secure Note",
+            "--title",
+            pack_title(prefix),
+            "--vault",
+            vault_id,
+        ]
+    )
+    _remember_pack(vault_id, note["id"], note["version"], items)
+    return note["id"]
+
+
+def update_pack(vault_id, note_id, prefix, mutate):
+    """
+    Read-modify-write of a pack.
+
+    `mutate` receives a copy of the packed items and returns the new items.
+    Writers on this host take turns. `op item edit` is unconditional, so a writer on
+    another host can still overwrite our edit: the pack is read again after every edit,
+    and the change re-applied until the fresh read shows it is present.
+    Returns the items as they were before the change took effect.
+    """
+    with advisory_lock(vault_id, note_id):
+        _, previous = read_pack(vault_id, note_id, refresh=True)
+        items = previous
+        for _ in range(PACK_WRITE_ATTEMPTS):
+            updated = mutate(dict(items))
+            if updated == items:
+                return previous
+            note = run_op_command_json(
+                ["item", "edit", note_id, encode_pack(updated), "--vault", vault_id]
+            )
+            _remember_pack(vault_id, note_id, note["version"], updated)
+            _, items = read_pack(vault_id, note_id, refresh=True)
+    raise PackConflict(prefix)
+
+
+def delete_pack(vault_id, note_id):
+    delete_secure_note_by_id(vault_id, note_id)
+    _pack_cache.pop(note_id, None)
+
+
+def pack_namespace(vault_id, prefix):
+    """Moves every loose `<prefix>.*` note into the pack for `prefix`."""
+    names_and_ids = list_all_secure_note_names_and_ids(vault_id)
+    loose = [
+        (title, note_id)
+        for title, note_id in names_and_ids
+        if title.startswith(prefix + ".")
+    ]
+    items = {
+        title: get_secure_note_content_by_id(vault_id, note_id)
+        for title, note_id in loose
+    }
+    pack_id = get_packed_prefixes(names_and_ids).get(prefix, None)
+    # Loose notes take precedence over keys already in the pack
+    forget_snapshot_keys(vault_id, items)
+    if pack_id is None:
+        create_pack(vault_id, prefix, items)
+    elif items:
+        update_pack(vault_id, pack_id, prefix, lambda existing: {**existing, **items})
+    for _, note_id in loose:
+        delete_secure_note_by_id(vault_id, note_id)
+    return len(loose)
+
+
+def unpack_namespace(vault_id, prefix):
+    """Splits the pack for `prefix` back into one note per key."""
+    names_and_ids = list_all_secure_note_names_and_ids(vault_id)
+    pack_id = get_packed_prefixes(names_and_ids).get(prefix, None)
+    if pack_id is None:
+        raise NoteNotFound(f"Namespace '{prefix}' is not packed.")
+    _, items = read_pack(vault_id, pack_id, refresh=True)
+    for key, value in items.items():
+        upsert_secure_note_fields(vault_id, key, {"value": value}, names_and_ids)
+    delete_pack(vault_id, pack_id)
+    return len(items)
 
 
 def get_item(vault_id, key):
-    note_id = obtain_secure_note_id_by_name(vault_id, key)
+    names_and_ids = list_all_secure_note_names_and_ids(vault_id)
+    _, pack_id = find_pack_for_key(names_and_ids, key)
+    if pack_id is not None:
+        _, items = read_pack(vault_id, pack_id)
+        if key in items:
+            return items[key]
+    note_id = find_note_id(names_and_ids, key)
     if note_id is None:
         return None
     return get_secure_note_content_by_id(vault_id, note_id)
 
 
 def set_item(vault_id, key, item_content):
-    return upsert_secure_note_by_name(vault_id, key, item_content)
+    # Writers of the same key on this host take turns,
+    # so only one of them can see the key missing and create it
+    with advisory_lock(vault_id, key):
+        created = _set_item(vault_id, key, item_content)
+    forget_snapshot_keys(vault_id, [key])
+    return created
+
+
+def _set_item(vault_id, key, item_content):
+    names_and_ids = list_all_secure_note_names_and_ids(vault_id)
+    note_id = find_note_id(names_and_ids, key)
+    prefix, pack_id = find_pack_for_key(names_and_ids, key)
+    if pack_id is None:
+        if note_id is not None:
+            update_secure_note_by_id(vault_id, note_id, item_content)
+            return False
+        create_unique_secure_note(vault_id, key, {"value": item_content})
+        return True
+    previous = update_pack(
+        vault_id, pack_id, prefix, lambda items: {**items, key: item_content}
+    )
+    # Drop any note left over from before the namespace was packed,
+    # so the key lives in exactly one place
+    if note_id is not None:
+        delete_secure_note_by_id(vault_id, note_id)
+        record_key(vault_id, key, False)
+    return key not in previous and note_id is None
 
 
 def delete_item(vault_id, key):
-    delete_secure_note_by_name(vault_id, key)
+    forget_snapshot_keys(vault_id, [key])
+    names_and_ids = list_all_secure_note_names_and_ids(vault_id)
+    prefix, pack_id = find_pack_for_key(names_and_ids, key)
+    if pack_id is not None:
+        _, items = read_pack(vault_id, pack_id)
+        if key in items:
+            update_pack(
+                vault_id,
+                pack_id,
+                prefix,
+                lambda items: {k: v for k, v in items.items() if k != key},
+            )
+            return
+    note_id = find_note_id(names_and_ids, key)
+    if note_id is None:
+        raise NoteNotFound(f"Secure note with name '{key}' not found.")
+    delete_secure_note_by_id(vault_id, note_id)
+    record_key(vault_id, key, False)
+
+
+def list_item_records(vault_id, notes=None, max_workers=DEFAULT_CONCURRENCY):
+    """
+    Lists every key in the vault with the time it was last updated.
+    Keys of a packed namespace share the update time of their pack.
+    `notes` may be passed in by callers that already listed the vault.
+    """
+    if notes is None:
+        notes = list_all_secure_notes(vault_id)
+    newest = {}
+    for note in newest_first(notes):
+        newest.setdefault(note["title"], note)
+    records = []
+    seen = set()
+    for note in notes:
+        if is_pack_title(note["title"]) or note["title"] in seen:
+            continue
+        seen.add(note["title"])
+        updated_at = newest[note["title"]].get("updated_at", None)
+        records.append({"key": note["title"], "updated_at": updated_at})
+    packs = [note for title, note in newest.items() if is_pack_title(title)]
+    pack_items = parallel_map(
+        lambda note: read_pack(vault_id, note["id"])[1], packs, max_workers
+    )
+    for note, items in zip(packs, pack_items):
+        for key in items:
+            if key not in seen:
+                records.append({"key": key, "updated_at": note.get("updated_at", None)})
+                seen.add(key)
+    return records
 
 
 def list_items(vault_id):
-    return [item_name for item_name, _ in list_all_secure_note_names_and_ids(vault_id)]
+    return [record["key"] for record in list_item_records(vault_id)]
+
+
+def resolve_vaults(vault_names=(), all_vaults=False):
+    """
+    Returns (name, id) pairs for the requested vaults, from a single vault list.
+    Falls back to the vault selected for the current project.
+    """
+    if all_vaults:
+        return [(vault["name"], vault["id"]) for vault in get_vault_list()]
+    if not vault_names:
+        vault_id = infer_selected_vault()
+        return [(infer_selected_vault_name(), vault_id)]
+    try:
+        return [(name, get_vault_id(name)) for name in vault_names]
+    except VaultNotFound as e:
+        die(str(e))
+
+
+def list_item_records_in_vaults(vaults, max_workers=DEFAULT_CONCURRENCY):
+    """Lists (name, id) vaults concurrently, tagging each record with its vault"""
+    # Vaults and the packs within them share the budget of concurrent op calls
+    pack_workers = max(1, max_workers // max(1, len(vaults)))
+
+    def list_vault(vault):
+        name, vault_id = vault
+        return [
+            {"vault": name, **record}
+            for record in list_item_records(vault_id, max_workers=pack_workers)
+        ]
+
+    return [
+        record
+        for records in parallel_map(list_vault, vaults, max_workers)
+        for record in records
+    ]
 
 
 def clear_items(vault_id):
-    all_items = list_items(vault_id)
-    for item in all_items:
-        delete_item(vault_id, item)
+    forget_vault_snapshots(vault_id)
+    for _, note_id in list_all_secure_note_names_and_ids(vault_id):
+        delete_secure_note_by_id(vault_id, note_id)
+    _pack_cache.clear()
 
 
 def has_item(vault_id, key):
-    return obtain_secure_note_id_by_name(vault_id, key) is not None
+    names_and_ids = list_all_secure_note_names_and_ids(vault_id)
+    _, pack_id = find_pack_for_key(names_and_ids, key)
+    if pack_id is not None and key in read_pack(vault_id, pack_id)[1]:
+        return True
+    return find_note_id(names_and_ids, key) is not None
+
+
+def compact_duplicates(vault_id, duplicates, max_workers=DEFAULT_CONCURRENCY):
+    """
+    Keeps only the newest note of each duplicated title.
+    The keys of older duplicate packs are merged into the newest pack first.
+    """
+
+    def compact(title):
+        newest, *older = duplicates[title]
+        if is_pack_title(title):
+            merged = {}
+            for note in reversed(older):
+                merged.update(read_pack(vault_id, note["id"], refresh=True)[1])
+            update_pack(
+                vault_id,
+                newest["id"],
+                title[len(PACK_TITLE_PREFIX) :],
+                lambda items: {**merged, **items},
+            )
+            forget_snapshot_keys(vault_id, merged)
+        else:
+            forget_snapshot_keys(vault_id, [title])
+        for note in older:
+            delete_secure_note_by_id(vault_id, note["id"], missing_ok=True)
+            _pack_cache.pop(note["id"], None)
+
+    parallel_map(compact, list(duplicates), max_workers)
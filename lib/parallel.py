@@ -0,0 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
+
+# op calls are dominated by network round trips, so a handful of threads is plenty
+DEFAULT_CONCURRENCY = 8
+
+
+def parallel_map(fn, items, max_workers=DEFAULT_CONCURRENCY):
+    """
+    Like `list(map(fn, items))`, but runs `fn` on a thread pool.
+    Results are returned in the order of `items`.
+    """
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(fn, items))
@@ -0,0 +1,159 @@
+"""
+One authenticated op session, shared by every op process an invocation spawns
+
+The first op call of an invocation runs alone and doubles as the check that op is
+signed in, so concurrent calls wait for it instead of each triggering an authorization.
+If op is not signed in, `op signin` is run once (interactively) and the session it
+prints is passed to every later call in its OP_SESSION_<account> environment variable,
+never on the command line, where other local users could read it.
+Sessions expire after SESSION_IDLE_TIMEOUT_SECONDS without use, so a call made after a
+long pause (e.g. a confirmation prompt) checks the session first, signing in again
+if needed. Authentication failures are reported once and end the command, rather than
+failing item by item.
+"""
+
+import os
+import re
+import sys
+import time
+import threading
+import subprocess
+
+from lib.cli import die
+
+SESSION_IDLE_TIMEOUT_SECONDS = 30 * 60
+SESSION_REFRESH_MARGIN_SECONDS = 5 * 60
+
+AUTH_ERROR_PATTERNS = [
+    "not currently signed in",
+    "account is not signed in",
+    "session expired",
+    "invalid session token",
+    "authorization prompt dismissed",
+    "authorization timeout",
+    "no accounts configured",
+    "(401) unauthorized",
+]
+
+_lock = threading.Lock()
+_failed_lock = threading.Lock()
+_failed = False
+_validated = False
+# (environment variable name, token) of the session we signed in to, if any
+_session = None
+# Incremented whenever a new session is established
+_generation = 0
+_last_used = 0.0
+
+
+def is_auth_error(stderr):
+    stderr = stderr.lower()
+    return any(pattern in stderr for pattern in AUTH_ERROR_PATTERNS)
+
+
+# Matches `export OP_SESSION_x="..."` as well as PowerShell's `$env:OP_SESSION_x="..."`
+SESSION_EXPORT_PATTERN = re.compile(r"(OP_SESSION_\w+)=\"?([^\"\s]+)\"?")
+
+
+def get_session_env():
+    """The environment for op processes, or None to inherit ours unchanged"""
+    if _session is None:
+        return None
+    name, token = _session
+    return {**os.environ, name: token}
+
+
+def report_auth_failure(detail):
+    """Ends the command; only the first thread to fail prints why"""
+    global _failed
+    with _failed_lock:
+        first = not _failed
+        _failed = True
+    if not first:
+        sys.exit(1)
+    if os.environ.get("OP_SERVICE_ACCOUNT_TOKEN"):
+        hint = "Check that OP_SERVICE_ACCOUNT_TOKEN is valid and can access the vault"
+    else:
+        hint = (
+            "Sign in with `eval $(op signin)`, or unlock the 1Password app, and retry"
+        )
+    die(f"1Password authentication failed: {detail.strip()}\n{hint}")
+
+
+def sign_in(op_command):
+    """Establishes a new session, prompting on the terminal if op needs it"""
+    global _session, _generation
+    if os.environ.get("OP_SERVICE_ACCOUNT_TOKEN"):
+        report_auth_failure("the service account token was rejected")
+    if not sys.stdin.isatty():
+        report_auth_failure("op is not signed in, and there is no terminal to sign in")
+    sys.stderr.write("Signing in to 1Password...\n")
+    p = subprocess.run(op_command + ["signin"], stdout=subprocess.PIPE)
+    if p.returncode != 0:
+        report_auth_failure("`op signin` did not succeed")
+    # With the 1Password app integration there is no session, op asks the app instead
+    match = SESSION_EXPORT_PATTERN.search(p.stdout.decode("utf-8"))
+    _session = match.groups() if match else None
+    _generation += 1
+
+
+def _run_checked(run, op_command):
+    """Runs a call that also validates the session, signing in once if it is rejected"""
+    global _validated, _last_used
+    result = run(get_session_env())
+    if is_auth_error(result[2]):
+        sign_in(op_command)
+        result = run(get_session_env())
+        if is_auth_error(result[2]):
+            report_auth_failure(result[2])
+    _validated = True
+    _last_used = time.monotonic()
+    return result
+
+
+def _needs_check():
+    idle = time.monotonic() - _last_used
+    refresh_after = SESSION_IDLE_TIMEOUT_SECONDS - SESSION_REFRESH_MARGIN_SECONDS
+    return not _validated or idle > refresh_after
+
+
+def run_in_session(run, op_command):
+    """
+    Calls run(session_env) -> (returncode, stdout, stderr) once the session is
+    established, where session_env is the environment to run op with.
+    """
+    global _last_used
+    if _needs_check():
+        with _lock:
+            if not _validated:
+                return _run_checked(run, op_command)
+            if _needs_check():
+                # Using the session resets its idle timer, or tells us it expired
+                _run_checked(
+                    lambda session_env: run_whoami(op_command, session_env),
+                    op_command,
+                )
+
+    generation = _generation
+    result = run(get_session_env())
+    if is_auth_error(result[2]):
+        # The session ended under us, sign in again unless another call already did
+        with _lock:
+            if _generation == generation:
+                sign_in(op_command)
+        result = run(get_session_env())
+        if is_auth_error(result[2]):
+            report_auth_failure(result[2])
+    _last_used = time.monotonic()
+    return result
+
+
+def run_whoami(op_command, session_env):
+    p = subprocess.run(
+        op_command + ["whoami"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        stdin=subprocess.DEVNULL,
+        env=session_env,
+    )
+    return p.returncode, p.stdout.decode("utf-8"), p.stderr.decode("utf-8")
@@ -0,0 +1,87 @@
+"""
+Local snapshots of vault contents written by `opkvs warm`
+
+A snapshot holds the values of a project's manifest keys, so later `get-item` calls
+(e.g. during container start-up) are answered without calling op.
+Snapshots live in the user cache directory, readable by the current user only,
+and are ignored once older than the project's `snapshot_ttl` (in seconds).
+"""
+
+import os
+import json
+import time
+import hashlib
+
+from lib.fs import get_cache_dir, file_put_text_contents_atomic
+
+DEFAULT_SNAPSHOT_TTL_SECONDS = 600
+
+
+def get_snapshot_path(vault_name):
+    digest = hashlib.sha1(vault_name.encode("utf-8")).hexdigest()
+    return os.path.join(get_cache_dir("snapshots"), f"{digest}.json")
+
+
+def _load(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_snapshot(vault_name, vault_id, items):
+    file_put_text_contents_atomic(
+        get_snapshot_path(vault_name),
+        json.dumps(
+            {
+                "vault_name": vault_name,
+                "vault_id": vault_id,
+                "fetched_at": time.time(),
+                "items": items,
+            }
+        ),
+    )
+
+
+def load_snapshot(vault_name, ttl=DEFAULT_SNAPSHOT_TTL_SECONDS):
+    """Returns the snapshotted items of a vault, or None if there is no fresh snapshot"""
+    snapshot = _load(get_snapshot_path(vault_name))
+    if snapshot is None or time.time() - snapshot["fetched_at"] > ttl:
+        return None
+    return snapshot["items"]
+
+
+def delete_snapshot(vault_name):
+    path = get_snapshot_path(vault_name)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _vault_snapshots(vault_id):
+    directory = get_cache_dir("snapshots")
+    for filename in os.listdir(directory):
+        path = os.path.join(directory, filename)
+        if not filename.endswith(".json"):
+            continue
+        snapshot = _load(path)
+        if snapshot is not None and snapshot["vault_id"] == vault_id:
+            yield path, snapshot
+
+
+def forget_snapshot_keys(vault_id, keys):
+    """Drops keys that were just written from every snapshot of the vault"""
+    keys = set(keys)
+    if not keys:
+        return
+    for path, snapshot in _vault_snapshots(vault_id):
+        if keys & set(snapshot["items"]):
+            for key in keys:
+                snapshot["items"].pop(key, None)
+            file_put_text_contents_atomic(path, json.dumps(snapshot))
+
+
+def forget_vault_snapshots(vault_id):
+    """Deletes every snapshot of a vault, e.g. after most of it was rewritten"""
+    for path, _ in list(_vault_snapshots(vault_id)):
+        os.remove(path)
@@ -0,0 +1,55 @@
+"""
+Size and staleness of vaults, from a single item listing of each
+
+Items of any category other than secure notes are counted as foreign, since opkvs only
+ever writes secure notes. Keys held in packs and value sizes are only known when a
+previous command read the pack (see lib/completion.py) or snapshotted the key
+(see lib/snapshot.py), so they are reported as lower bounds rather than read here.
+"""
+
+from lib.op import list_all_items, is_secure_note, is_pack_title
+from lib.completion import get_cached_pack_keys
+from lib.snapshot import load_snapshot
+from lib.parallel import parallel_map, DEFAULT_CONCURRENCY
+
+
+def summarize_vault(vault_name, vault_id, items):
+    notes = [item for item in items if is_secure_note(item)]
+    packs = [note for note in notes if is_pack_title(note["title"])]
+    keys = {note["title"] for note in notes if not is_pack_title(note["title"])}
+    pack_keys = get_cached_pack_keys(vault_id)
+    unread_packs = 0
+    for pack in packs:
+        if pack["id"] in pack_keys:
+            keys.update(pack_keys[pack["id"]])
+        else:
+            unread_packs += 1
+
+    snapshot = load_snapshot(vault_name, ttl=float("inf")) or {}
+    known_values = {key: value for key, value in snapshot.items() if key in keys}
+
+    updated = [item["updated_at"] for item in items if item.get("updated_at", None)]
+    return {
+        "vault": vault_name,
+        "id": vault_id,
+        "items": len(items),
+        "managed": len(notes),
+        "foreign": len(items) - len(notes),
+        "packs": len(packs),
+        "unread_packs": unread_packs,
+        "keys": len(keys),
+        "known_values": len(known_values),
+        "known_value_bytes": sum(
+            len(value.encode("utf-8")) for value in known_values.values()
+        ),
+        "last_updated": max(updated) if updated else None,
+    }
+
+
+def get_vault_stats(vaults, max_workers=DEFAULT_CONCURRENCY):
+    """Lists (name, id) vaults concurrently and summarizes each one"""
+    listings = parallel_map(lambda vault: list_all_items(vault[1]), vaults, max_workers)
+    return [
+        summarize_vault(name, vault_id, items)
+        for (name, vault_id), items in zip(vaults, listings)
+    ]
@@ -0,0 +1,245 @@
+"""
+Incremental replication of keys from one vault to another
+
+Both vaults are listed once. For every key, the id and version of the item holding it
+(the key's own note, or the pack of its namespace) are compared with the ones recorded
+by the previous sync of the same pair of vaults. Only keys whose items changed since then
+have their values fetched and compared, and only differing keys are written.
+"""
+
+import os
+import json
+
+from lib.op import (
+    list_all_secure_notes,
+    find_pack_for_key,
+    find_note_id,
+    is_pack_title,
+    read_pack,
+    get_names_and_ids,
+)
+from lib.batch import execute_operations
+from lib.fs import get_cache_dir, file_put_text_contents_atomic
+from lib.parallel import parallel_map, DEFAULT_CONCURRENCY
+
+
+def get_sync_state_path(src_vault_id, dst_vault_id):
+    return os.path.join(get_cache_dir("sync"), f"{src_vault_id}-{dst_vault_id}.json")
+
+
+def load_sync_state(src_vault_id, dst_vault_id):
+    try:
+        with open(
+            get_sync_state_path(src_vault_id, dst_vault_id), "r", encoding="utf-8"
+        ) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_sync_state(src_vault_id, dst_vault_id, state):
+    file_put_text_contents_atomic(
+        get_sync_state_path(src_vault_id, dst_vault_id), json.dumps(state)
+    )
+
+
+def parse_rename_prefix(rename_prefix):
+    """Parses `old.=new.` into ("old.", "new.")"""
+    if rename_prefix is None:
+        return None
+    if "=" not in rename_prefix:
+        raise ValueError(f"Expected OLD=NEW, got '{rename_prefix}'")
+    old, new = rename_prefix.split("=", 1)
+    return old, new
+
+
+def rename_key(key, rename):
+    if rename is not None and key.startswith(rename[0]):
+        return rename[1] + key[len(rename[0]) :]
+    return key
+
+
+def get_item_tokens(vault_id, notes, max_workers=DEFAULT_CONCURRENCY):
+    """
+    Maps every key in the vault to the (item id, item version) that holds it.
+    Reads packs, since their keys are not visible in the listing.
+    """
+    tokens = {
+        note["title"]: [note["id"], note.get("version", None)]
+        for note in notes
+        if not is_pack_title(note["title"])
+    }
+    packs = [note for note in notes if is_pack_title(note["title"])]
+    pack_items = parallel_map(
+        lambda note: read_pack(vault_id, note["id"])[1], packs, max_workers
+    )
+    for note, items in zip(packs, pack_items):
+        for key in items:
+            tokens[key] = [note["id"], note.get("version", None)]
+    return tokens
+
+
+def get_listed_tokens(notes, keys):
+    """Maps keys to the (item id, item version) holding them, from a listing alone"""
+    names_and_ids = get_names_and_ids(notes)
+    versions = {note["id"]: note.get("version", None) for note in notes}
+    tokens = {}
+    for key in keys:
+        _, pack_id = find_pack_for_key(names_and_ids, key)
+        note_id = pack_id or find_note_id(names_and_ids, key)
+        tokens[key] = [note_id, versions[note_id]] if note_id is not None else None
+    return tokens
+
+
+def read_values(vault_id, notes, keys, max_workers):
+    operations = [{"op": "get", "key": key} for key in keys]
+    names_and_ids = get_names_and_ids(notes)
+    return {
+        result["key"]: result["value"]
+        for result in execute_operations(
+            vault_id, operations, max_workers, names_and_ids=names_and_ids
+        )
+    }
+
+
+def plan_sync(
+    src_vault_id,
+    dst_vault_id,
+    prefix=None,
+    rename=None,
+    delete_extra=False,
+    max_workers=DEFAULT_CONCURRENCY,
+):
+    """
+    Works out what copying `src` into `dst` would change.
+
+    Returns a dict with `created`, `updated` and `deleted` lists of destination keys,
+    the number of `unchanged` keys, the batch `operations` that apply the changes,
+    and what is needed to record the new sync state afterwards.
+    """
+    src_notes, dst_notes = parallel_map(
+        list_all_secure_notes, [src_vault_id, dst_vault_id], max_workers
+    )
+    src_tokens = get_item_tokens(src_vault_id, src_notes, max_workers)
+    dst_keys = {note["title"] for note in dst_notes if not is_pack_title(note["title"])}
+    state = load_sync_state(src_vault_id, dst_vault_id)
+
+    src_keys = [key for key in src_tokens if prefix is None or key.startswith(prefix)]
+    key_map = {key: rename_key(key, rename) for key in src_keys}
+    dst_tokens = get_listed_tokens(dst_notes, key_map.values())
+
+    to_compare = []
+    new_state = {}
+    for src_key, dst_key in key_map.items():
+        dst_token = dst_tokens[dst_key]
+        previous = state.get(dst_key, None)
+        if (
+            previous is not None
+            and dst_token is not None
+            and previous["key"] == src_key
+            and previous["src"] == src_tokens[src_key]
+            and previous["dst"] == dst_token
+        ):
+            new_state[dst_key] = previous
+        else:
+            to_compare.append(src_key)
+
+    if delete_extra:
+        # Keys in destination packs are not in the listing
+        dst_packs = [note["id"] for note in dst_notes if is_pack_title(note["title"])]
+        for items in parallel_map(
+            lambda pack_id: read_pack(dst_vault_id, pack_id)[1], dst_packs, max_workers
+        ):
+            dst_keys.update(items)
+
+    src_values, dst_values = parallel_map(
+        lambda args: read_values(*args, max_workers),
+        [
+            (src_vault_id, src_notes, to_compare),
+            (dst_vault_id, dst_notes, [key_map[key] for key in to_compare]),
+        ],
+        2,
+    )
+
+    created, updated, operations = [], [], []
+    for src_key in to_compare:
+        dst_key = key_map[src_key]
+        value = src_values[src_key]
+        if value is None:
+            continue
+        if dst_values[dst_key] is None:
+            created.append(dst_key)
+        elif dst_values[dst_key] != value:
+            updated.append(dst_key)
+        else:
+            new_state[dst_key] = {
+                "key": src_key,
+                "src": src_tokens[src_key],
+                "dst": dst_tokens[dst_key],
+            }
+            continue
+        operations.append({"op": "set", "key": dst_key, "value": value})
+
+    deleted = []
+    if delete_extra:
+        # Only keys under the (renamed) prefix being synced are mirrored
+        if prefix is not None:
+            dst_prefix = rename_key(prefix, rename)
+        else:
+            dst_prefix = rename[1] if rename is not None else ""
+        kept = set(key_map.values())
+        if src_vault_id == dst_vault_id:
+            # Copying within a vault must not delete what it copies from
+            kept.update(src_keys)
+        deleted = sorted(
+            key for key in dst_keys if key.startswith(dst_prefix) and key not in kept
+        )
+        operations.extend({"op": "delete", "key": key} for key in deleted)
+
+    return {
+        "created": created,
+        "updated": updated,
+        "deleted": deleted,
+        "unchanged": len(key_map) - len(created) - len(updated),
+        "operations": operations,
+        "dst_notes": dst_notes,
+        "key_map": key_map,
+        "src_tokens": src_tokens,
+        "state": new_state,
+    }
+
+
+def apply_sync(src_vault_id, dst_vault_id, plan, max_workers=DEFAULT_CONCURRENCY):
+    """Writes the planned changes, then records the new state of every synced key"""
+    state = plan["state"]
+    dst_notes = plan["dst_notes"]
+    if plan["operations"]:
+        names_and_ids = get_names_and_ids(dst_notes)
+        for _ in execute_operations(
+            dst_vault_id, plan["operations"], max_workers, names_and_ids=names_and_ids
+        ):
+            pass
+        # Written items got new versions, one more listing records them
+        changed_keys = {operation["key"] for operation in plan["operations"]}
+        old_notes = dst_notes
+        dst_notes = list_all_secure_notes(dst_vault_id)
+        # Writing into a pack also changes the version every other key in it
+        # was recorded against, so those are refreshed too
+        touched = {
+            token[0]
+            for notes in [old_notes, dst_notes]
+            for token in get_listed_tokens(notes, changed_keys).values()
+            if token is not None
+        }
+        old_tokens = get_listed_tokens(old_notes, state)
+        for src_key, dst_key in plan["key_map"].items():
+            if dst_key in changed_keys:
+                state[dst_key] = {"key": src_key, "src": plan["src_tokens"][src_key]}
+        new_tokens = get_listed_tokens(dst_notes, state)
+        for dst_key, entry in state.items():
+            old_token = old_tokens.get(dst_key, None)
+            if "dst" not in entry or (
+                old_token is not None and old_token[0] in touched
+            ):
+                entry["dst"] = new_tokens[dst_key]
+    save_sync_state(src_vault_id, dst_vault_id, state)
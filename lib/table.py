@@ -0,0 +1,23 @@
+def format_table(rows, columns):
+    """
+    Formats a list of dicts as a plain-text table with the given columns.
+    Missing values are left blank.
+    """
+    cells = [
+        [
+            "" if row.get(column, None) is None else str(row[column])
+            for column in columns
+        ]
+        for row in rows
+    ]
+    widths = [
+        max([len(column)] + [len(row[i]) for row in cells])
+        for i, column in enumerate(columns)
+    ]
+
+    def format_line(values):
+        return "  ".join(value.ljust(width) for value, width in zip(values, widths))
+
+    lines = [format_line(columns), format_line(["-" * width for width in widths])]
+    lines.extend(format_line(row) for row in cells)
+    return "\n".join(line.rstrip() for line in lines)
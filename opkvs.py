@@ -1,23 +1,38 @@
 import sys
+import json
+from fnmatch import fnmatchcase
 
 import click
 
 from lib.op import (
     get_vault_id,
     VaultNotFound,
-    obtain_secure_note_id_by_name,
-    delete_secure_note_by_name,
-    get_secure_note_content_by_id,
-    upsert_secure_note_by_name,
-    list_all_secure_note_names_and_ids,
+    get_item as read_item,
+    set_item as write_item,
+    delete_item as remove_item,
+    has_item,
     infer_selected_vault,
+    infer_selected_vault_name,
+    resolve_vaults,
+    list_item_records_in_vaults,
 )
-from lib.config import Config
+from lib.config import Config, read_config_value
 from lib.cli import die, warn
+from lib.completion import complete_key, complete_vault_name
+from lib.parallel import DEFAULT_CONCURRENCY
+from lib.table import format_table
+from lib.snapshot import load_snapshot, DEFAULT_SNAPSHOT_TTL_SECONDS
 
 from routes.vault import handler as route_vault
 from routes.config import handler as route_config
 from routes.ssh import handler as route_ssh, ssh_compile
+from routes.completion import handler as route_completion
+from routes.pack import pack, unpack
+from routes.batch import batch
+from routes.sync import copy_vault, sync_vault
+from routes.compact import compact
+from routes.warm import warm
+from routes.bench import bench
 
 
 @click.group()
@@ -48,22 +63,34 @@ def cli():
 
 
 @cli.command()
-@click.argument("key", type=str)
+@click.argument("key", type=str, shell_complete=complete_key)
 @click.option("-s", "--silent", is_flag=True, default=False)
-@click.option("--vault", type=str, default=None)
-def get_item(key, silent=False, vault=None):
+@click.option("--vault", type=str, default=None, shell_complete=complete_vault_name)
+@click.option(
+    "--no-snapshot",
+    is_flag=True,
+    default=False,
+    help="Ignore the local snapshot written by `opkvs warm`",
+)
+def get_item(key, silent=False, vault=None, no_snapshot=False):
+    vault_name = infer_selected_vault_name(vault)
+    if vault_name is not None and not no_snapshot:
+        ttl = read_config_value("snapshot_ttl", DEFAULT_SNAPSHOT_TTL_SECONDS)
+        snapshot = load_snapshot(vault_name, ttl)
+        if snapshot is not None and snapshot.get(key, None) is not None:
+            sys.stdout.write(snapshot[key])
+            return
     vault_id = infer_selected_vault(vault)
-    note_id = obtain_secure_note_id_by_name(vault_id, key)
-    if not note_id:
+    contents = read_item(vault_id, key)
+    if contents is None:
         warn(f"No item with key '{key}' found in vault '{vault_id}'", silent)
         return
-    contents = get_secure_note_content_by_id(vault_id, note_id)
     sys.stdout.write(contents)
 
 
 def upsert_content_procedure(key, value, silent=False, vault=None):
     vault_id = infer_selected_vault(vault)
-    is_creating_new = upsert_secure_note_by_name(vault_id, key, value)
+    is_creating_new = write_item(vault_id, key, value)
     if not silent:
         if is_creating_new:
             print("Creating new item with the specified content...")
@@ -72,10 +99,10 @@ def upsert_content_procedure(key, value, silent=False, vault=None):
 
 
 @cli.command()
-@click.argument("key", type=str)
+@click.argument("key", type=str, shell_complete=complete_key)
 @click.option("--file", type=click.Path(exists=True), required=False, default=None)
 @click.option("-s", "--silent", is_flag=True, default=False)
-@click.option("--vault", type=str, default=None)
+@click.option("--vault", type=str, default=None, shell_complete=complete_vault_name)
 def set_item(key, file=None, silent=False, vault=None):
 
     final_value = None
@@ -96,10 +123,10 @@ def set_item(key, file=None, silent=False, vault=None):
 
 
 @cli.command()
-@click.argument("key", type=str)
+@click.argument("key", type=str, shell_complete=complete_key)
 @click.option("-y", "--yes", is_flag=True, default=False)
 @click.option("-s", "--silent", is_flag=True, default=False)
-@click.option("--vault", type=str, default=None)
+@click.option("--vault", type=str, default=None, shell_complete=complete_vault_name)
 def delete_item(
     key,
     yes=False,
@@ -107,31 +134,90 @@ def delete_item(
     vault=None,
 ):
     vault_id = infer_selected_vault(vault)
-    note_id = obtain_secure_note_id_by_name(vault_id, key)
-    if not note_id:
+    if not has_item(vault_id, key):
         warn(f"No item with key '{key}' found in vault '{vault_id}'", silent)
         return
     if not yes:
         if not click.confirm(f"Are you sure you want to delete item with key '{key}'?"):
             return
-    delete_secure_note_by_name(vault_id, key)
+    remove_item(vault_id, key)
     print("Successfully delete item with the specified key...")
 
 
+def print_item_records(records, format):
+    if format == "json":
+        print(json.dumps(records, indent=2))
+    else:
+        print(format_table(records, ["vault", "key", "updated_at"]))
+
+
 @cli.command()
-@click.option("--vault", type=str, default=None)
-def list_items(vault=None):
-    vault_id = infer_selected_vault(vault)
-    names_and_ids = list_all_secure_note_names_and_ids(vault_id)
-    for name, _ in names_and_ids:
-        print(name)
+@click.option(
+    "--vault",
+    type=str,
+    multiple=True,
+    shell_complete=complete_vault_name,
+    help="May be given more than once",
+)
+@click.option("--all-vaults", is_flag=True, default=False)
+@click.option("--format", default=None, type=click.Choice(["plain", "table", "json"]))
+@click.option("-j", "--jobs", type=int, default=DEFAULT_CONCURRENCY)
+def list_items(vault=(), all_vaults=False, format=None, jobs=DEFAULT_CONCURRENCY):
+    vaults = resolve_vaults(vault, all_vaults)
+    if format is None:
+        format = "plain" if len(vaults) == 1 else "table"
+    records = list_item_records_in_vaults(vaults, jobs)
+    if format == "plain":
+        for record in records:
+            if len(vaults) == 1:
+                print(record["key"])
+            else:
+                print(f"{record['vault']}\t{record['key']}")
+    else:
+        print_item_records(records, format)
+
+
+@cli.command()
+@click.argument("pattern", type=str)
+@click.option(
+    "--vault",
+    type=str,
+    multiple=True,
+    shell_complete=complete_vault_name,
+    help="Search only these vaults (may be given more than once)",
+)
+@click.option("--format", default="table", type=click.Choice(["table", "json"]))
+@click.option("-j", "--jobs", type=int, default=DEFAULT_CONCURRENCY)
+def search(pattern, vault=(), format="table", jobs=DEFAULT_CONCURRENCY):
+    """
+    Find keys matching PATTERN across vaults
+
+    PATTERN is a glob such as 'production.*' or '*.api-key'.
+    All vaults are searched unless --vault is given.
+    """
+    vaults = resolve_vaults(vault, all_vaults=not vault)
+    records = [
+        record
+        for record in list_item_records_in_vaults(vaults, jobs)
+        if fnmatchcase(record["key"], pattern)
+    ]
+    print_item_records(records, format)
 
 
 cli.add_command(route_vault, "vault")
 cli.add_command(route_config, "config")
 cli.add_command(route_ssh, "ssh")
+cli.add_command(route_completion, "completion")
 cli.add_command(ssh_compile)
+cli.add_command(pack)
+cli.add_command(unpack)
+cli.add_command(batch)
+cli.add_command(copy_vault)
+cli.add_command(sync_vault)
+cli.add_command(compact)
+cli.add_command(warm)
+cli.add_command(bench)
 
 
 if __name__ == "__main__":
-    cli()
+    cli(prog_name="opkvs", complete_var="_OPKVS_COMPLETE")
@@ -0,0 +1,53 @@
+"""
+Run many get/set/delete operations against a vault in a single invocation
+"""
+
+import sys
+import json
+
+import click
+
+from lib.op import infer_selected_vault, get_op_call_count
+from lib.batch import parse_script, execute_operations, BatchScriptError
+from lib.parallel import DEFAULT_CONCURRENCY
+from lib.cli import die
+from lib.completion import complete_vault_name
+
+
+@click.command()
+@click.option("--file", type=click.Path(exists=True), required=False, default=None)
+@click.option("-j", "--jobs", type=int, default=DEFAULT_CONCURRENCY)
+@click.option("-s", "--silent", is_flag=True, default=False)
+@click.option("--vault", type=str, default=None, shell_complete=complete_vault_name)
+def batch(file=None, jobs=DEFAULT_CONCURRENCY, silent=False, vault=None):
+    """
+    Run a script of operations read from --file or stdin
+
+    Each line is either JSON, e.g. {"op": "set", "key": "a.b", "value": "c"},
+    or the shorthand `set KEY VALUE`, `get KEY` or `delete KEY`.
+    One JSON result per operation is written to stdout, in input order.
+    """
+    if file:
+        with open(file, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    else:
+        lines = sys.stdin.read().splitlines()
+    try:
+        operations = parse_script(lines)
+    except BatchScriptError as e:
+        die(str(e))
+
+    vault_id = infer_selected_vault(vault)
+    stats = {}
+    for result in execute_operations(vault_id, operations, jobs, stats=stats):
+        sys.stdout.write(json.dumps(result) + "\n")
+        sys.stdout.flush()
+
+    if not silent:
+        # Includes the vault lookup, as the estimate for separate invocations does
+        calls = get_op_call_count()
+        saved = stats.get("unbatched_calls", 0) - calls
+        sys.stderr.write(
+            f"Ran {len(operations)} operation(s) with {calls} op call(s), "
+            f"{max(saved, 0)} fewer than separate invocations\n"
+        )
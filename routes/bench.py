@@ -0,0 +1,165 @@
+"""
+Measure the latency and throughput of opkvs operations against the op backend
+"""
+
+import os
+import sys
+import json
+import platform
+import tempfile
+import subprocess
+
+import click
+
+from lib.op import get_vault_id, VaultNotFound, run_op_command, set_op_command
+from lib.bench import parse_mix, run_level
+from lib.cli import die
+from lib.completion import complete_vault_name
+from lib.table import format_table
+
+
+def get_opkvs_revision():
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "-C", repo, "rev-parse", "--short", "HEAD"],
+                stdin=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode("utf-8")
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_levels(levels):
+    rows = []
+    for level in levels:
+        for name, stats in level["by_operation"].items():
+            rows.append(
+                {
+                    "jobs": level["concurrency"],
+                    "op/s": level["throughput"],
+                    "operation": name,
+                    "count": stats["count"],
+                    "p50 ms": stats["latency_ms"]["p50"],
+                    "p95 ms": stats["latency_ms"]["p95"],
+                    "p99 ms": stats["latency_ms"]["p99"],
+                    "calls/op": stats["op_calls_per_operation"],
+                    "spawn p50": (stats["spawn_ms"] or {}).get("p50"),
+                    "op p50": (stats["op_run_ms"] or {}).get("p50"),
+                }
+            )
+    columns = ["jobs", "op/s", "operation", "count", "p50 ms", "p95 ms", "p99 ms"]
+    columns += ["calls/op", "spawn p50", "op p50"]
+    return format_table(rows, columns)
+
+
+@click.command()
+@click.option(
+    "--backend",
+    type=click.Choice(["fake", "op"]),
+    default="fake",
+    help="`fake` runs against a local stand-in for op (lib/fake_op.py)",
+)
+@click.option(
+    "--vault",
+    type=str,
+    default=None,
+    shell_complete=complete_vault_name,
+    help="Scratch vault to use with --backend op",
+)
+@click.option("--mix", type=str, default="list=1,get=4,set=2,delete=1")
+@click.option(
+    "--concurrency",
+    type=str,
+    default="1,2,4,8",
+    help="Comma-separated concurrency levels to sweep",
+)
+@click.option("--operations", type=int, default=40, help="Operations per level")
+@click.option("--keys", type=int, default=10, help="Distinct keys per worker")
+@click.option("--fake-latency-ms", type=float, default=0.0)
+@click.option("--seed", type=int, default=0)
+@click.option("--output", type=click.Path(), default=None, help="Write results as JSON")
+@click.option("-y", "--yes", is_flag=True, default=False)
+def bench(
+    backend,
+    vault,
+    mix,
+    concurrency,
+    operations,
+    keys,
+    fake_latency_ms,
+    seed,
+    output,
+    yes,
+):
+    """
+    Profile list/get/set/delete latency at several concurrency levels
+
+    Reports throughput and p50/p95/p99 latency per operation type, with the
+    time spent spawning op processes and waiting for op broken out.
+    Only keys starting with `opkvs-bench.` are written, and they are deleted again.
+    """
+    try:
+        weights = parse_mix(mix)
+        levels = [int(level) for level in concurrency.split(",")]
+    except ValueError as e:
+        die(str(e))
+    if any(level < 1 for level in levels):
+        die("Concurrency levels must be at least 1")
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        if backend == "fake":
+            os.environ["OPKVS_FAKE_OP_STATE"] = os.path.join(state_dir, "state.json")
+            os.environ["OPKVS_FAKE_OP_LATENCY_MS"] = str(fake_latency_ms)
+            # Keep the fake vault out of the completion index and snapshots
+            os.environ["XDG_CACHE_HOME"] = os.path.join(state_dir, "cache")
+            fake_op = os.path.join(
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                "lib",
+                "fake_op.py",
+            )
+            set_op_command([sys.executable, fake_op])
+            vault_id = "fake-bench"
+            op_version = "fake"
+        else:
+            if not vault:
+                die("--vault is required with --backend op, use a scratch vault")
+            try:
+                vault_id = get_vault_id(vault)
+            except VaultNotFound as e:
+                die(str(e))
+            if not yes and not click.confirm(
+                f"Create and delete `opkvs-bench.*` items in vault '{vault}'?"
+            ):
+                return
+            op_version = run_op_command(["--version"]).strip()
+
+        results = []
+        for level in levels:
+            sys.stderr.write(
+                f"Running {operations} operations with {level} job(s)...\n"
+            )
+            results.append(run_level(vault_id, weights, level, operations, keys, seed))
+
+    print(format_levels(results))
+
+    if output:
+        report = {
+            "host": platform.node(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "opkvs_revision": get_opkvs_revision(),
+            "backend": backend,
+            "op_version": op_version,
+            "mix": weights,
+            "operations_per_level": operations,
+            "keys_per_worker": keys,
+            "fake_latency_ms": fake_latency_ms if backend == "fake" else None,
+            "levels": results,
+        }
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
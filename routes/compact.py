@@ -0,0 +1,60 @@
+"""
+Find and remove items that share a title, e.g. after concurrent writers both created the same key
+"""
+
+import click
+
+from lib.op import (
+    resolve_vaults,
+    list_all_secure_notes,
+    find_duplicate_notes,
+    compact_duplicates,
+)
+from lib.parallel import parallel_map, DEFAULT_CONCURRENCY
+from lib.completion import complete_vault_name
+from lib.table import format_table
+
+
+@click.command()
+@click.option(
+    "--vault",
+    type=str,
+    multiple=True,
+    shell_complete=complete_vault_name,
+    help="May be given more than once",
+)
+@click.option("--all-vaults", is_flag=True, default=False)
+@click.option("--dry-run", is_flag=True, default=False)
+@click.option("-y", "--yes", is_flag=True, default=False)
+@click.option("-j", "--jobs", type=int, default=DEFAULT_CONCURRENCY)
+def compact(
+    vault=(), all_vaults=False, dry_run=False, yes=False, jobs=DEFAULT_CONCURRENCY
+):
+    """
+    Remove duplicate items with the same title, keeping the newest
+
+    Duplicate packs are merged into the newest one before being removed.
+    """
+    vaults = resolve_vaults(vault, all_vaults)
+    duplicates_per_vault = parallel_map(
+        lambda vault: find_duplicate_notes(list_all_secure_notes(vault[1])),
+        vaults,
+        jobs,
+    )
+    rows = [
+        {"vault": name, "title": title, "copies": len(notes), "kept": notes[0]["id"]}
+        for (name, _), duplicates in zip(vaults, duplicates_per_vault)
+        for title, notes in duplicates.items()
+    ]
+    if not rows:
+        print("No duplicate items found...")
+        return
+    print(format_table(rows, ["vault", "title", "copies", "kept"]))
+    if dry_run:
+        return
+    if not yes:
+        if not click.confirm("Remove the older copies of these items?"):
+            return
+    for (_, vault_id), duplicates in zip(vaults, duplicates_per_vault):
+        compact_duplicates(vault_id, duplicates, jobs)
+    print("Successfully removed duplicate items...")
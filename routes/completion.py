@@ -0,0 +1,52 @@
+"""
+Shell completion for opkvs, served from an on-disk index of vault names and keys
+"""
+
+import click
+from click.shell_completion import get_completion_class
+
+from lib.op import get_vault_list, get_vault_id, list_items, VaultNotFound
+from lib.completion import complete_vault_name
+from lib.config import read_config_value
+
+
+@click.group()
+def handler():
+    pass
+
+
+@handler.command()
+@click.argument("shell", type=click.Choice(["bash", "zsh", "fish"]))
+@click.pass_context
+def script(ctx, shell):
+    """
+    Print the completion script for SHELL
+
+    e.g. add `eval "$(opkvs completion script bash)"` to ~/.bashrc
+    """
+    completion_class = get_completion_class(shell)
+    completion = completion_class(
+        ctx.find_root().command, {}, "opkvs", "_OPKVS_COMPLETE"
+    )
+    print(completion.source())
+
+
+@handler.command()
+@click.option("--vault", type=str, default=None, shell_complete=complete_vault_name)
+def refresh(vault=None):
+    """
+    Refresh the completion index (vault names, and keys of the selected vault)
+
+    Normal commands keep the index up to date as they go,
+    and completion refreshes stale entries in the background.
+    """
+    get_vault_list()
+    # Runs in whatever directory completion was used in, so only read opkvs.json,
+    # never create it
+    vault_name = vault or read_config_value("vault_name", None)
+    if not vault_name:
+        return
+    try:
+        list_items(get_vault_id(vault_name))
+    except VaultNotFound:
+        pass
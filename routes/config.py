@@ -28,3 +28,29 @@ def get_vault():
         sys.stdout.write("")
         return
     sys.stdout.write(vault_name)
+
+
+@handler.command()
+@click.argument("entry", required=True, type=str)
+def add_manifest_entry(entry):
+    """
+    Require ENTRY for `opkvs warm`, either a key or a prefix ending in `.*`
+    """
+    manifest = Config().get("manifest", [])
+    if entry not in manifest:
+        Config().set("manifest", manifest + [entry])
+
+
+@handler.command()
+@click.argument("entry", required=True, type=str)
+def remove_manifest_entry(entry):
+    manifest = Config().get("manifest", [])
+    if entry not in manifest:
+        die(f"'{entry}' is not in the manifest")
+    Config().set("manifest", [e for e in manifest if e != entry])
+
+
+@handler.command()
+def get_manifest():
+    for entry in Config().get("manifest", []):
+        print(entry)
@@ -0,0 +1,48 @@
+"""
+Commands to migrate a namespace of keys (e.g. `production.*`) in and out of a single packed item
+"""
+
+import click
+
+from lib.op import (
+    infer_selected_vault,
+    pack_namespace,
+    unpack_namespace,
+    NoteNotFound,
+)
+from lib.cli import die
+from lib.completion import complete_vault_name
+
+
+@click.command()
+@click.argument("prefix", type=str)
+@click.option("-s", "--silent", is_flag=True, default=False)
+@click.option("--vault", type=str, default=None, shell_complete=complete_vault_name)
+def pack(prefix, silent=False, vault=None):
+    """
+    Store every key starting with PREFIX. in one item
+
+    Reading any number of keys from a packed namespace costs a single
+    op call. New keys under PREFIX. are written into the pack as well.
+    """
+    vault_id = infer_selected_vault(vault)
+    count = pack_namespace(vault_id, prefix.rstrip("."))
+    if not silent:
+        print(f"Packed {count} item(s) into namespace '{prefix}'...")
+
+
+@click.command()
+@click.argument("prefix", type=str)
+@click.option("-s", "--silent", is_flag=True, default=False)
+@click.option("--vault", type=str, default=None, shell_complete=complete_vault_name)
+def unpack(prefix, silent=False, vault=None):
+    """
+    Split a packed namespace back into one item per key
+    """
+    vault_id = infer_selected_vault(vault)
+    try:
+        count = unpack_namespace(vault_id, prefix.rstrip("."))
+    except NoteNotFound as e:
+        die(str(e))
+    if not silent:
+        print(f"Unpacked {count} item(s) from namespace '{prefix}'...")
@@ -18,12 +18,37 @@ from lib.op import (
     infer_selected_vault,
     infer_selected_vault_name,
     has_item,
-    delete_item,
     get_vault_id,
     VaultNotFound,
+    list_all_secure_note_names_and_ids,
+    find_note_id,
+    get_secure_note_content_by_id,
+    get_secure_note_fields_by_id,
+    upsert_secure_note_fields,
+    update_secure_note_fields_by_id,
+    delete_secure_note_by_id,
 )
 from lib.cli import die
+from lib.completion import complete_vault_name, find_vault_name, get_cached_keys
 from lib.fs import file_get_text_contents, file_put_text_contents
+from lib.snapshot import forget_snapshot_keys
+
+
+# Each user is stored as a single item titled `ssh-user:<username>`,
+# with one field per credential, so it can be read or written in one op call.
+# Vaults written by older versions store one item per credential
+# (`users.<username>.<field>`), which is still read and can be migrated
+# with `opkvs ssh migrate-users`.
+USER_RECORD_PREFIX = "ssh-user:"
+USER_FIELDS = ["password", "ssh_passphrase", "id_rsa", "authorized_keys"]
+
+
+def get_user_record_title(username):
+    return USER_RECORD_PREFIX + username
+
+
+def get_legacy_user_item_key(username, field):
+    return f"users.{username}.{field}"
 
 
 def check_item_name(item_name):
@@ -33,12 +58,16 @@ def check_item_name(item_name):
         return True
     if item_name == "port":
         return True
+    if item_name.startswith(USER_RECORD_PREFIX):
+        return True
     if re.match(r"^users\.(.*?)\.password$", item_name):
         return True
     if re.match(r"^users\.(.*?)\.id_rsa$", item_name):
         return True
     if re.match(r"^users\.(.*?)\.ssh_passphrase$", item_name):
         return True
+    if re.match(r"^users\.(.*?)\.authorized_keys$", item_name):
+        return True
     return False
 
 
@@ -54,7 +83,7 @@ def check_vault_setup(vault_id):
     )
 
 
-def get_users_from_item_list(item_list):
+def get_legacy_users_from_item_list(item_list):
     user_regex = re.compile(r"^users\.(.*?)\.id_rsa$")
     users = []
     for item in item_list:
@@ -64,13 +93,96 @@ def get_users_from_item_list(item_list):
     return users
 
 
-def has_user(vault_id, username):
-    users = get_users_from_item_list(list_items(vault_id))
-    return username in users
+def get_users_from_item_list(item_list):
+    users = [
+        item[len(USER_RECORD_PREFIX) :]
+        for item in item_list
+        if item.startswith(USER_RECORD_PREFIX)
+    ]
+    for user in get_legacy_users_from_item_list(item_list):
+        if user not in users:
+            users.append(user)
+    return users
+
+
+def read_user_from_listing(vault_id, names_and_ids, username):
+    """
+    Returns the credentials of a user as a dict of field name to value,
+    or None if the user does not exist
+    """
+    record_id = find_note_id(names_and_ids, get_user_record_title(username))
+    if record_id is not None:
+        return get_secure_note_fields_by_id(vault_id, record_id, USER_FIELDS)
+    return read_legacy_user_fields(vault_id, names_and_ids, username) or None
+
+
+def read_legacy_user_fields(vault_id, names_and_ids, username):
+    """The credentials a user has in the legacy layout, ignoring any record"""
+    fields = {}
+    for field in USER_FIELDS:
+        note_id = find_note_id(names_and_ids, get_legacy_user_item_key(username, field))
+        if note_id is not None:
+            fields[field] = get_secure_note_content_by_id(vault_id, note_id)
+    return fields
+
+
+def delete_legacy_user_items(vault_id, names_and_ids, username):
+    forget_snapshot_keys(
+        vault_id, [get_legacy_user_item_key(username, field) for field in USER_FIELDS]
+    )
+    for field in USER_FIELDS:
+        note_id = find_note_id(names_and_ids, get_legacy_user_item_key(username, field))
+        if note_id is not None:
+            delete_secure_note_by_id(vault_id, note_id)
+
+
+def write_user(vault_id, username, fields, names_and_ids):
+    """
+    Upserts the given credential fields of a user, leaving other fields as they are.
+    A user still stored in the legacy layout is migrated to a single record on write.
+    `names_and_ids` is the listing of the vault the command already made.
+    """
+    title = get_user_record_title(username)
+    if find_note_id(names_and_ids, title) is not None:
+        upsert_secure_note_fields(vault_id, title, fields, names_and_ids)
+        return
+    legacy_fields = read_legacy_user_fields(vault_id, names_and_ids, username)
+    upsert_secure_note_fields(
+        vault_id, title, {**legacy_fields, **fields}, names_and_ids
+    )
+    delete_legacy_user_items(vault_id, names_and_ids, username)
+
+
+def delete_user(vault_id, username, names_and_ids):
+    forget_snapshot_keys(vault_id, [get_user_record_title(username)])
+    # Including duplicate records left behind by racing writers
+    for title, note_id in names_and_ids:
+        if title == get_user_record_title(username):
+            delete_secure_note_by_id(vault_id, note_id, missing_ok=True)
+    delete_legacy_user_items(vault_id, names_and_ids, username)
+
+
+def complete_username(ctx, param, incomplete):
+    vault_name = find_vault_name(ctx)
+    if not vault_name:
+        return []
+    users = get_users_from_item_list(get_cached_keys(vault_name))
+    return [user for user in users if user.startswith(incomplete)]
+
+
+def require_user(ctx, username, names_and_ids=None):
+    vault_id = ctx.obj["vault_id"]
+    vault_name = ctx.obj["vault_name"]
+    if names_and_ids is None:
+        names_and_ids = list_all_secure_note_names_and_ids(vault_id)
+    fields = read_user_from_listing(vault_id, names_and_ids, username)
+    if fields is None:
+        die(f"User '{username}' does not exist in vault '{vault_name}'")
+    return fields
 
 
 @click.group()
-@click.option("--vault", type=str, default=None)
+@click.option("--vault", type=str, default=None, shell_complete=complete_vault_name)
 @click.pass_context
 def handler(ctx, vault=None):
     ctx.ensure_object(dict)
@@ -168,66 +280,71 @@ def add_user(
     identity_file,
 ):
     vault_id = ctx.obj["vault_id"]
-    item_key_password = f"users.{username}.password"
-    item_key_ssh_passphrase = f"users.{username}.ssh_passphrase"
-    item_key_id_rsa = f"users.{username}.id_rsa"
-    set_item(vault_id, item_key_password, file_get_text_contents(password_file))
-    set_item(
-        vault_id, item_key_ssh_passphrase, file_get_text_contents(ssh_passphrase_file)
+    write_user(
+        vault_id,
+        username,
+        {
+            "password": file_get_text_contents(password_file),
+            "ssh_passphrase": file_get_text_contents(ssh_passphrase_file),
+            "id_rsa": file_get_text_contents(identity_file),
+        },
+        list_all_secure_note_names_and_ids(vault_id),
     )
-    set_item(vault_id, item_key_id_rsa, file_get_text_contents(identity_file))
 
 
 @handler.command()
 @click.pass_context
-@click.argument("username", type=str)
+@click.argument("username", type=str, shell_complete=complete_username)
 def remove_user(ctx, username):
     vault_id = ctx.obj["vault_id"]
-    vault_name = ctx.obj["vault_name"]
-    if not has_user(vault_id, username):
-        die(f"User '{username}' does not exist in vault '{vault_name}'")
-    item_key_password = f"users.{username}.password"
-    item_key_ssh_passphrase = f"users.{username}.ssh_passphrase"
-    item_key_id_rsa = f"users.{username}.id_rsa"
-    delete_item(vault_id, item_key_password)
-    delete_item(vault_id, item_key_ssh_passphrase)
-    delete_item(vault_id, item_key_id_rsa)
+    names_and_ids = list_all_secure_note_names_and_ids(vault_id)
+    require_user(ctx, username, names_and_ids)
+    delete_user(vault_id, username, names_and_ids)
 
 
 @handler.command()
 @click.pass_context
-@click.argument("username", type=str)
-def get_user_ssh_passphrase(ctx, username):
+def migrate_users(ctx):
+    """
+    Convert users stored as one item per credential into single-item user records
+    """
     vault_id = ctx.obj["vault_id"]
-    vault_name = ctx.obj["vault_name"]
-    if not has_user(vault_id, username):
-        die(f"User '{username}' does not exist in vault '{vault_name}'")
-    item_key = f"users.{username}.ssh_passphrase"
-    sys.stdout.write(get_item(vault_id, item_key))
+    names_and_ids = list_all_secure_note_names_and_ids(vault_id)
+    titles = [title for title, _ in names_and_ids]
+    for username in get_legacy_users_from_item_list(titles):
+        fields = read_legacy_user_fields(vault_id, names_and_ids, username)
+        record_id = find_note_id(names_and_ids, get_user_record_title(username))
+        if record_id is None:
+            upsert_secure_note_fields(
+                vault_id, get_user_record_title(username), fields, names_and_ids
+            )
+        else:
+            # The record wins over anything left behind in the legacy layout
+            existing = get_secure_note_fields_by_id(vault_id, record_id, USER_FIELDS)
+            update_secure_note_fields_by_id(vault_id, record_id, {**fields, **existing})
+        delete_legacy_user_items(vault_id, names_and_ids, username)
+        print(f"Migrated user '{username}'...")
 
 
 @handler.command()
 @click.pass_context
-@click.argument("username", type=str)
+@click.argument("username", type=str, shell_complete=complete_username)
+def get_user_ssh_passphrase(ctx, username):
+    sys.stdout.write(require_user(ctx, username).get("ssh_passphrase", ""))
+
+
+@handler.command()
+@click.pass_context
+@click.argument("username", type=str, shell_complete=complete_username)
 def get_user_password(ctx, username):
-    vault_id = ctx.obj["vault_id"]
-    vault_name = ctx.obj["vault_name"]
-    if not has_user(vault_id, username):
-        die(f"User '{username}' does not exist in vault '{vault_name}'")
-    item_key = f"users.{username}.password"
-    sys.stdout.write(get_item(vault_id, item_key))
+    sys.stdout.write(require_user(ctx, username).get("password", ""))
 
 
 @handler.command()
 @click.pass_context
-@click.argument("username", type=str)
+@click.argument("username", type=str, shell_complete=complete_username)
 def get_user_id_rsa(ctx, username):
-    vault_id = ctx.obj["vault_id"]
-    vault_name = ctx.obj["vault_name"]
-    if not has_user(vault_id, username):
-        die(f"User '{username}' does not exist in vault '{vault_name}'")
-    item_key = f"users.{username}.id_rsa"
-    sys.stdout.write(get_item(vault_id, item_key))
+    sys.stdout.write(require_user(ctx, username).get("id_rsa", ""))
 
 
 def process_authorized_keys_text(contents):
@@ -237,16 +354,7 @@ def process_authorized_keys_text(contents):
     return contents
 
 
-@handler.command()
-@click.pass_context
-@click.argument("username", type=str)
-@click.option("--file", type=str, required=False, default=None)
-def set_user_authorized_keys(ctx, username, file):
-    vault_id = ctx.obj["vault_id"]
-    vault_name = ctx.obj["vault_name"]
-    if not has_user(vault_id, username):
-        die(f"User '{username}' does not exist in vault '{vault_name}'")
-    item_key = f"users.{username}.authorized_keys"
+def read_authorized_keys_input(file):
     contents = None
     if file is not None:
         contents = file_get_text_contents(file)
@@ -256,48 +364,44 @@ def set_user_authorized_keys(ctx, username, file):
             contents = stdin_contents
     if contents is None:
         die("No input. Either pipe into stdin or specify a file with `--file=<FILE>`")
-    contents = process_authorized_keys_text(contents)
-    set_item(vault_id, item_key, contents)
+    return process_authorized_keys_text(contents)
 
 
 @handler.command()
 @click.pass_context
-@click.argument("username", type=str)
+@click.argument("username", type=str, shell_complete=complete_username)
+@click.option("--file", type=str, required=False, default=None)
+def set_user_authorized_keys(ctx, username, file):
+    vault_id = ctx.obj["vault_id"]
+    names_and_ids = list_all_secure_note_names_and_ids(vault_id)
+    require_user(ctx, username, names_and_ids)
+    contents = read_authorized_keys_input(file)
+    write_user(vault_id, username, {"authorized_keys": contents}, names_and_ids)
+
+
+@handler.command()
+@click.pass_context
+@click.argument("username", type=str, shell_complete=complete_username)
 @click.option("--file", type=str, required=False, default=None)
 def add_user_authorized_keys(ctx, username, file):
     vault_id = ctx.obj["vault_id"]
-    vault_name = ctx.obj["vault_name"]
-    if not has_user(vault_id, username):
-        die(f"User '{username}' does not exist in vault '{vault_name}'")
-    item_key = f"users.{username}.authorized_keys"
-    contents = None
-    if file is not None:
-        contents = file_get_text_contents(file)
-    if contents is None:
-        stdin_contents = sys.stdin.read()
-        if stdin_contents:
-            contents = stdin_contents
-    if contents is None:
-        die("No input. Either pipe into stdin or specify a file with `--file=<FILE>`")
-    existing_contents = get_item(vault_id, get_item)
-    if existing_contents is None:
-        existing_contents = ""
-    existing_contents = process_authorized_keys_text(contents)
-    new_contents = process_authorized_keys_text(contents)
-    set_item(vault_id, item_key, "\n".join([existing_contents, new_contents]))
+    names_and_ids = list_all_secure_note_names_and_ids(vault_id)
+    existing_contents = require_user(ctx, username, names_and_ids).get(
+        "authorized_keys", ""
+    )
+    new_contents = read_authorized_keys_input(file)
+    if existing_contents:
+        new_contents = process_authorized_keys_text(
+            "\n".join([existing_contents, new_contents])
+        )
+    write_user(vault_id, username, {"authorized_keys": new_contents}, names_and_ids)
 
 
 @handler.command()
 @click.pass_context
-@click.argument("username", type=str)
+@click.argument("username", type=str, shell_complete=complete_username)
 def get_user_authorized_keys(ctx, username):
-    vault_id = ctx.obj["vault_id"]
-    vault_name = ctx.obj["vault_name"]
-    if not has_user(vault_id, username):
-        die(f"User '{username}' does not exist in vault '{vault_name}'")
-    item_key = f"users.{username}.authorized_keys"
-    contents = get_item(vault_id, item_key)
-    sys.stdout.write(contents)
+    sys.stdout.write(require_user(ctx, username).get("authorized_keys", ""))
 
 
 @click.command()
@@ -316,7 +420,7 @@ def get_user_authorized_keys(ctx, username):
     required=False,
     default=None,
 )
-@click.argument("vaults", nargs=-1, type=str)
+@click.argument("vaults", nargs=-1, type=str, shell_complete=complete_vault_name)
 def ssh_compile(target_os, windows_user_home, vaults):
     if target_os is None:
         target_os = "windows" if os.name == "nt" else "posix"
@@ -364,10 +468,11 @@ def ssh_compile(target_os, windows_user_home, vaults):
 
             os.mkdir(vault_user_identities_path)
 
-            users = get_users_from_item_list(list_items(vault))
+            names_and_ids = list_all_secure_note_names_and_ids(vault_id)
+            users = get_users_from_item_list([title for title, _ in names_and_ids])
 
             for user in users:
-                id_rsa = get_item(vault, f"users.{user}.id_rsa")
+                id_rsa = read_user_from_listing(vault_id, names_and_ids, user)["id_rsa"]
                 os.mkdir(os.path.join(vault_user_identities_path, user))
                 file_put_text_contents(
                     os.path.join(vault_user_identities_path, user, "id_rsa"), id_rsa
@@ -0,0 +1,109 @@
+"""
+Commands to replicate keys from one vault to another, copying only what changed
+"""
+
+import click
+
+from lib.op import get_vault_id, VaultNotFound, get_op_call_count
+from lib.sync import plan_sync, apply_sync, parse_rename_prefix
+from lib.parallel import DEFAULT_CONCURRENCY
+from lib.cli import die
+from lib.completion import complete_vault_name
+
+
+def replicate_vault(
+    src, dst, prefix, rename_prefix, delete_extra, dry_run, jobs, silent
+):
+    try:
+        rename = parse_rename_prefix(rename_prefix)
+    except ValueError as e:
+        die(str(e))
+    try:
+        src_vault_id = get_vault_id(src)
+        dst_vault_id = get_vault_id(dst)
+    except VaultNotFound as e:
+        die(str(e))
+    if src_vault_id == dst_vault_id and rename is None:
+        die("Source and destination vault are the same")
+
+    plan = plan_sync(src_vault_id, dst_vault_id, prefix, rename, delete_extra, jobs)
+
+    if dry_run or not silent:
+        for marker, keys in [
+            ("+", plan["created"]),
+            ("~", plan["updated"]),
+            ("-", plan["deleted"]),
+        ]:
+            for key in keys:
+                print(f"{marker} {key}")
+    if dry_run:
+        return
+
+    apply_sync(src_vault_id, dst_vault_id, plan, jobs)
+    if not silent:
+        print(
+            f"{len(plan['created'])} created, {len(plan['updated'])} updated, "
+            f"{len(plan['deleted'])} deleted, {plan['unchanged']} unchanged "
+            f"({get_op_call_count()} op calls)"
+        )
+
+
+def replication_options(command):
+    for option in reversed(
+        [
+            click.argument("src", type=str, shell_complete=complete_vault_name),
+            click.argument("dst", type=str, shell_complete=complete_vault_name),
+            click.option(
+                "--prefix",
+                type=str,
+                default=None,
+                help="Only copy keys starting with this prefix",
+            ),
+            click.option(
+                "--rename-prefix",
+                type=str,
+                default=None,
+                help="Rewrite a key prefix on the way, e.g. staging.=production.",
+            ),
+            click.option(
+                "--dry-run",
+                is_flag=True,
+                default=False,
+                help="Only print what would change",
+            ),
+            click.option("-j", "--jobs", type=int, default=DEFAULT_CONCURRENCY),
+            click.option("-s", "--silent", is_flag=True, default=False),
+        ]
+    ):
+        command = option(command)
+    return command
+
+
+@click.command()
+@replication_options
+@click.option(
+    "--delete",
+    is_flag=True,
+    default=False,
+    help="Delete keys in DST (under the prefix) that are not in SRC",
+)
+def copy_vault(src, dst, prefix, rename_prefix, dry_run, jobs, silent, delete):
+    """
+    Copy new and changed keys from vault SRC to vault DST
+
+    Keys whose items did not change since the last copy between the same
+    vaults are skipped without being read, so repeated copies cost
+    little more than listing both vaults.
+    """
+    replicate_vault(src, dst, prefix, rename_prefix, delete, dry_run, jobs, silent)
+
+
+@click.command()
+@replication_options
+def sync_vault(src, dst, prefix, rename_prefix, dry_run, jobs, silent):
+    """
+    Make DST (under the prefix) an exact copy of SRC
+
+    Same as `copy-vault --delete`.
+    """
+    replicate_vault(src, dst, prefix, rename_prefix, True, dry_run, jobs, silent)
@@ -1,11 +1,16 @@
-import subprocess
 import json
 
 import click
-import pandas as pd
 
 from lib.cli import die
-from lib.op import get_vault_id, VaultNotFound
+from lib.op import get_vault_list, get_vault_id, VaultNotFound, resolve_vaults
+from lib.completion import complete_vault_name
+from lib.parallel import DEFAULT_CONCURRENCY
+from lib.stats import get_vault_stats
+from lib.table import format_table
+
+STATS_COLUMNS = ["vault", "items", "managed", "foreign", "packs", "keys"]
+STATS_COLUMNS += ["known_value_bytes", "last_updated"]
 
 
 @click.group()
@@ -13,15 +18,6 @@ def handler():
     pass
 
 
-def get_vault_list():
-    as_list = json.loads(
-        subprocess.check_output(
-            ["op", "vault", "list", "--format=json"], stdin=subprocess.DEVNULL
-        ).decode("utf-8")
-    )
-    return as_list
-
-
 @handler.command()
 @click.option("--format", default="table", type=click.Choice(["json", "table"]))
 def list(format):
@@ -29,8 +25,31 @@ def list(format):
     if format == "json":
         print(json.dumps(vault_list, indent=2))
     elif format == "table":
-        df = pd.DataFrame.from_records(vault_list)
-        print(df)
+        columns = []
+        for vault in vault_list:
+            columns.extend(column for column in vault if column not in columns)
+        print(format_table(vault_list, columns))
+
+
+@handler.command()
+@click.option(
+    "--vault",
+    type=str,
+    multiple=True,
+    shell_complete=complete_vault_name,
+    help="Vaults to report on, all of them by default",
+)
+@click.option("--format", default="table", type=click.Choice(["json", "table"]))
+@click.option("-j", "--jobs", type=int, default=DEFAULT_CONCURRENCY)
+def stats(vault=(), format="table", jobs=DEFAULT_CONCURRENCY):
+    """
+    Item counts, opkvs-managed vs. foreign items, value sizes and last update of vaults
+    """
+    vault_stats = get_vault_stats(resolve_vaults(vault, all_vaults=not vault), jobs)
+    if format == "json":
+        print(json.dumps(vault_stats, indent=2))
+    else:
+        print(format_table(vault_stats, STATS_COLUMNS))
 
 
 @handler.command()
@@ -0,0 +1,68 @@
+"""
+Prefetch the keys a project needs into a local snapshot before a deploy
+"""
+
+import click
+
+from lib.op import (
+    infer_selected_vault,
+    infer_selected_vault_name,
+    list_all_secure_notes,
+    list_item_records,
+    get_names_and_ids,
+)
+from lib.batch import execute_operations
+from lib.manifest import resolve_manifest
+from lib.snapshot import save_snapshot, delete_snapshot
+from lib.config import Config
+from lib.parallel import DEFAULT_CONCURRENCY
+from lib.cli import die
+from lib.completion import complete_vault_name
+
+
+@click.command()
+@click.option("--vault", type=str, default=None, shell_complete=complete_vault_name)
+@click.option("-j", "--jobs", type=int, default=DEFAULT_CONCURRENCY)
+@click.option("--clear", is_flag=True, default=False, help="Delete the snapshot")
+@click.option("-s", "--silent", is_flag=True, default=False)
+def warm(vault=None, jobs=DEFAULT_CONCURRENCY, clear=False, silent=False):
+    """
+    Fetch every key in the project manifest into a local snapshot
+
+    Fails, listing every missing key, if the vault lacks any of them.
+    Until the snapshot expires (see `snapshot_ttl` in opkvs.json),
+    `get-item` answers these keys without calling 1Password.
+    """
+    vault_name = infer_selected_vault_name(vault)
+    if clear:
+        if vault_name is not None:
+            delete_snapshot(vault_name)
+        return
+
+    manifest = Config().get("manifest", [])
+    if not manifest:
+        die(
+            "No manifest in opkvs.json, add keys with `opkvs config add-manifest-entry`"
+        )
+    vault_id = infer_selected_vault(vault)
+
+    notes = list_all_secure_notes(vault_id)
+    keys = [record["key"] for record in list_item_records(vault_id, notes, jobs)]
+    required, missing = resolve_manifest(manifest, keys)
+    if missing:
+        die(
+            f"Vault '{vault_name}' is missing {len(missing)} required key(s):\n"
+            + "\n".join(f"  {entry}" for entry in missing)
+        )
+
+    results = execute_operations(
+        vault_id,
+        [{"op": "get", "key": key} for key in required],
+        jobs,
+        names_and_ids=get_names_and_ids(notes),
+    )
+    save_snapshot(
+        vault_name, vault_id, {result["key"]: result["value"] for result in results}
+    )
+    if not silent:
+        print(f"Warmed {len(required)} item(s) from vault '{vault_name}'...")